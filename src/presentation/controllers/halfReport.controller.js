@@ -71,7 +71,11 @@ function ensurePyWorker() {
               percentage: parsed.percentage,
               macro_id: parsed.macro_id,
               form_id: parsed.form_id,
-              error: parsed.error
+              error: parsed.error,
+              seq: parsed.seq,
+              throughput_per_min: parsed.throughput_per_min,
+              eta_s: parsed.eta_s,
+              position: parsed.position
             }
           });
         }
@@ -86,7 +90,7 @@ function ensurePyWorker() {
       }
 
       // Immediate control responses
-      if (["PAUSED", "RESUMED", "STOPPED"].includes(parsed.status)) {
+      if (["PAUSED", "RESUMED", "ALREADY_QUEUED", "STOPPED", "QUEUE_STATUS"].includes(parsed.status)) {
         const handler = pending.get("control");
         if (handler) {
           handler.resolve(parsed);
@@ -110,7 +114,7 @@ function ensurePyWorker() {
       }
 
       // Task completion responses
-      const finalStatuses = ["SUCCESS", "FAILED", "CLOSED", "LOGIN_SUCCESS", "NOT_FOUND", "OTP_REQUIRED", "OTP_FAILED"];
+      const finalStatuses = ["SUCCESS", "FAILED", "CLOSED", "LOGIN_SUCCESS", "NOT_FOUND", "OTP_REQUIRED", "OTP_FAILED", "QUEUE_FULL"];
       if (finalStatuses.includes(parsed.status)) {
         const handler = pending.get("task");
         if (handler) {
@@ -209,8 +213,8 @@ const loginOrOtp = async (req, res, next) => {
   const { email, password, otp } = req.body;
   try {
     let payload;
-    if (otp) payload = { action: "otp", otp };
-    else if (email && password) payload = { action: "login", email, password };
+    if (otp) payload = { action: "otp", otp, userId: req.user?.userId };
+    else if (email && password) payload = { action: "login", email, password, userId: req.user?.userId };
     else return res.status(400).json({ success: false, message: "Email/password or OTP required" });
 
     const response = await sendCommand(payload);
@@ -227,7 +231,7 @@ const fillReportForm2 = async (req, res, next) => {
   if (isNaN(tabsNum) || tabsNum < 1) tabsNum = 3;
 
   try {
-    const response = await sendCommand({ action: "formFill2", reportId: id, tabsNum, socketMode: true });
+    const response = await sendCommand({ action: "formFill2", reportId: id, tabsNum, socketMode: true, userId: req.user?.userId });
     res.json(response);
   } catch (err) {
     console.error("[fillReportForm2] error:", err);
@@ -275,11 +279,12 @@ const resume = async (req, res, next) => {
     const response = await sendCommand({ 
       action: "resume", 
       reportId: id,
-      taskId 
+      taskId,
+      userId: req.user?.userId
     }, "control");
     
     // Emit resume event to socket
-    if (io) {
+    if (io && response.status === 'RESUMED') {
       io.to(`report_${id}`).emit('form_fill_resumed', {
         reportId: id,
         status: 'RESUMED',
@@ -315,13 +320,23 @@ const stop = async (req, res, next) => {
   }
 };
 
+const queueStatus = async (req, res, next) => {
+  try {
+    const response = await sendCommand({ action: "queueStatus" }, "control");
+    res.json(response);
+  } catch (err) {
+    console.error("[queueStatus] error:", err);
+    next(err instanceof AppError ? err : new AppError(String(err), 500));
+  }
+};
+
 const checkMacros = async (req, res, next) => {
   const { id } = req.body;
   let tabsNum = parseInt(req.body.tabsNum, 10);
   if (isNaN(tabsNum) || tabsNum < 1) tabsNum = 3;
 
   try {
-    const response = await sendCommand({ action: "checkMacros", reportId: id, tabsNum });
+    const response = await sendCommand({ action: "checkMacros", reportId: id, tabsNum, userId: req.user?.userId });
     res.json(response);
   } catch (err) {
     console.error("[checkMacros] error:", err);
@@ -335,7 +350,7 @@ const retryMacros = async (req, res, next) => {
   if (isNaN(tabsNum) || tabsNum < 1) tabsNum = 3;
 
   try {
-    const response = await sendCommand({ action: "retryMacros", recordId: id, tabsNum, socketMode: true });
+    const response = await sendCommand({ action: "retryMacros", recordId: id, tabsNum, socketMode: true, userId: req.user?.userId });
     res.json(response);
   } catch (err) {
     console.error("[retryMacros] error:", err);
@@ -397,7 +412,7 @@ const fillHalfReportForm = async (req, res, next) => {
       return res.status(400).json({ success: false, message: result.error });
     }
 
-    const response = await sendCommand({ action: "formFill", reportId: result.data._id });
+    const response = await sendCommand({ action: "formFill", reportId: result.data._id, userId: req.user.userId });
     res.json({
       success: true,
       status: "SAVED",
@@ -446,9 +461,10 @@ const extractExistingReportData = async (req, res, next) => {
 
 const addAssetsToReport = async (req, res, next) => {
   const { reportId } = req.body;
+  const userId = req.user.userId;
 
   try {
-    const response = await sendCommand({ action: "addAssets", reportId });
+    const response = await sendCommand({ action: "addAssets", reportId, userId });
     res.json(response);
   } catch (err) {
     console.error("[addAssetsToReport] error:", err);
@@ -460,7 +476,7 @@ const checkAssets = async (req, res, next) => {
   const { reportId } = req.body;
   
   try {
-    const response = await sendCommand({ action: "check", reportId });
+    const response = await sendCommand({ action: "check", reportId, userId: req.user?.userId });
     res.json(response);
   } catch (err) {
     console.error("[checkAssets] error:", err);
@@ -483,6 +499,7 @@ module.exports = {
   pause,
   resume,
   stop,
+  queueStatus,
   sendCommand,
   closeWorker,
   setSocketIO,  // Export to allow server.js to inject io instance
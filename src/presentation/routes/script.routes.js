@@ -15,6 +15,7 @@ const {
   pause,
   stop,
   resume,
+  queueStatus,
   retryMacros,
   getHalfReportsByUserId,
   reportDataExtraction
@@ -39,11 +40,13 @@ scriptRouter.post('/meqyasMultiple', runMultipleMeqyasScript);
 
 scriptRouter.post(
   '/equip/login',
+  authMiddleware,
   loginOrOtp
 );
 
 scriptRouter.post(
   '/equip/fillForm',
+  authMiddleware,
   upload.fields([
     { name: 'excel', maxCount: 1 },
     { name: 'pdfs', maxCount: 1 }
@@ -62,6 +65,7 @@ scriptRouter.post('/equip/retry', authMiddleware, retryMacros);
 scriptRouter.post('/equip/pause', authMiddleware, pause);
 scriptRouter.post('/equip/resume', authMiddleware, resume);
 scriptRouter.post('/equip/stop', authMiddleware, stop);
+scriptRouter.get('/equip/queue', authMiddleware, queueStatus);
 
 scriptRouter.post(
   '/equip/extractData',
@@ -83,6 +87,6 @@ scriptRouter.post(
   reportDataExtraction
 );
 
-scriptRouter.post('/equip/addAssets', addAssetsToReport);
+scriptRouter.post('/equip/addAssets', authMiddleware, addAssetsToReport);
 
 module.exports = scriptRouter;
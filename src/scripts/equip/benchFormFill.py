@@ -0,0 +1,148 @@
+"""
+Benchmark: macros per minute of runFormFill2 against the local qima stub.
+
+Starts qimaStub in-process, points QIMA_BASE_URL at it, and for every --tabs value
+inserts a throwaway halfreports record with --macros assets, runs the full flow
+(report creation or asset-only, macro edits, completeness check, retries) and
+deletes the record again. Completion is read back from the stub, so a fast run that
+leaves macros incomplete shows up as such.
+
+The records go to a bench database (--mongo-uri/--mongo-db, or BENCH_MONGO_URI and
+BENCH_MONGO_DB; a local mongod by default), never to the one MONGO_URI/MONGO_DB
+configure for the worker.
+
+    python benchFormFill.py --macros 40 --tabs 1 3 5 --latency-ms 150 --jitter-ms 100
+    python benchFormFill.py --flow without_base --tabs 3 6
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+# Modules shared with the taqeem worker (readiness, filler runtime, element waits) live in src/scripts/shared
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shared"))
+
+from qimaStub import add_stub_arguments, stub_from_args
+
+def make_asset(i):
+    return {
+        "asset_name": f"أصل تجريبي {i}",
+        "asset_type": "0",
+        "asset_usage_id": "1",
+        "value_base": "1",
+        "inspection_date": "01-01-2025",
+        "final_value": str(1000 + i),
+        "production_capacity": "0",
+        "production_capacity_measuring_unit": "0",
+        "owner_name": "مالك تجريبي",
+        "product_type": "0",
+        "market_approach": "1",
+        "market_approach_value": str(1000 + i),
+        "country": "المملكة العربية السعودية",
+        "region": "منطقة الرياض",
+        "city": "الرياض",
+        "submitState": 0,
+    }
+
+def make_record(flow, macros, report_id=None):
+    record = {"asset_data": [make_asset(i) for i in range(macros)], "benchmark": True}
+    if flow == "with_base":
+        record.update({
+            "title": "تقرير تجريبي",
+            "purpose_id": "1",
+            "value_premise_id": "1",
+            "value_base": "1",
+            "report_type": "تقرير مفصل",
+            "client_name": "عميل تجريبي",
+            "telephone": "0500000000",
+            "email": "bench@example.com",
+            "valued_at": "2025-01-01",
+            "submitted_at": "2025-01-02",
+            "value": "100000",
+            "valuation_currency": "1",
+        })
+    else:
+        record["report_id"] = str(report_id)
+    return record
+
+async def run_once(browser, stub, flow, macros, tabs):
+    from database import db
+    from formFiller2 import runFormFill2
+
+    report_id = stub.state.create_report() if flow == "without_base" else None
+    inserted = await db.halfreports.insert_one(make_record(flow, macros, report_id))
+    record_id = str(inserted.inserted_id)
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = await runFormFill2(browser, record_id, tabs_num=tabs)
+        elapsed = time.perf_counter() - start
+
+        record = await db.halfreports.find_one({"_id": inserted.inserted_id})
+        report_id = record.get("report_id") or report_id
+        completion = stub.state.report_stats(report_id) if report_id else {}
+        return {
+            "tabs": tabs,
+            "status": result.get("status"),
+            "elapsed_s": round(elapsed, 2),
+            "macros_per_min": round(macros / elapsed * 60, 1),
+            "report_id": report_id,
+            **completion,
+            "readiness": result.get("readiness"),
+            "db": result.get("db"),
+            "spans": result.get("spans"),
+        }
+    finally:
+        await db.halfreports.delete_one({"_id": inserted.inserted_id})
+
+def use_bench_database(args):
+    """Point the equip modules at the bench database, refusing the worker's configured one."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    configured = (os.getenv("MONGO_URI"), os.getenv("MONGO_DB", "projectForever"))
+    if (args.mongo_uri, args.mongo_db) == configured:
+        sys.exit(f"Refusing to benchmark against the configured database {args.mongo_db!r} at MONGO_URI: "
+                 f"pass --mongo-uri/--mongo-db for a separate one")
+    os.environ["MONGO_URI"] = args.mongo_uri
+    os.environ["MONGO_DB"] = args.mongo_db
+
+async def run(args):
+    use_bench_database(args)
+    stub = stub_from_args(args).start()
+    os.environ["QIMA_BASE_URL"] = stub.base_url
+
+    # Imported after QIMA_BASE_URL and the database are set: the equip modules read them at import time.
+    from browser import get_browser, closeBrowser
+
+    browser = await get_browser()
+    results = []
+    try:
+        for tabs in args.tabs:
+            results.append(await run_once(browser, stub, args.flow, args.macros, tabs))
+    finally:
+        await closeBrowser()
+        stub.stop()
+
+    print(json.dumps({
+        "flow": args.flow,
+        "macros": args.macros,
+        "latency_ms": [args.latency_ms, args.jitter_ms],
+        "runs": results,
+        "stub_requests": stub.state.requests,
+    }, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_stub_arguments(parser)
+    parser.add_argument("--flow", choices=("with_base", "without_base"), default="with_base")
+    parser.add_argument("--macros", type=int, default=40)
+    parser.add_argument("--tabs", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://127.0.0.1:27017"),
+                        help="database the throwaway records go to")
+    parser.add_argument("--mongo-db", default=os.getenv("BENCH_MONGO_DB", "equipBench"))
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""
+Benchmark: polling `wait_for_element` vs the MutationObserver waiter in browser.py.
+
+Each trial loads a blank page that inserts the target element after a random delay
+(the time qima takes to render a button or option list), then measures how long each
+waiter takes to hand the element back. The per-macro figure multiplies the mean
+saving by the number of waits a macro edit performs.
+
+    python benchWaits.py --trials 30 --waits-per-macro 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+# Modules shared with the taqeem worker (readiness, filler runtime, element waits) live in src/scripts/shared
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shared"))
+
+from browser import get_browser, closeBrowser, wait_for_element
+
+_SCHEDULE_JS = """
+(function() {
+    document.body.innerHTML = "";
+    setTimeout(() => {
+        const el = document.createElement("input");
+        el.type = "submit";
+        el.id = "bench-target";
+        document.body.appendChild(el);
+    }, %d);
+})();
+"""
+
+async def polling_wait_for_element(page, selector, timeout=30, check_interval=0.5):
+    """The loop the fillers used before the event-driven waiter."""
+    start_time = time.time()
+    while time.time() - start_time < timeout:
+        try:
+            element = await page.query_selector(selector)
+            if element:
+                return element
+        except Exception:
+            pass
+        await asyncio.sleep(check_interval)
+    return None
+
+async def measure(page, waiter, delay_ms):
+    await page.evaluate(_SCHEDULE_JS % delay_ms)
+    start = time.perf_counter()
+    element = await waiter(page, "#bench-target", timeout=10)
+    elapsed = time.perf_counter() - start
+    if not element:
+        raise RuntimeError(f"{waiter.__name__} timed out after a {delay_ms} ms delay")
+    return elapsed
+
+async def run(trials, waits_per_macro, min_delay, max_delay):
+    browser = await get_browser()
+    page = await browser.get("about:blank")
+
+    polling, observer = [], []
+    for _ in range(trials):
+        delay_ms = random.randint(min_delay, max_delay)
+        polling.append(await measure(page, polling_wait_for_element, delay_ms))
+        observer.append(await measure(page, wait_for_element, delay_ms))
+
+    saved_per_wait = statistics.mean(polling) - statistics.mean(observer)
+    summary = {
+        "trials": trials,
+        "delay_ms": [min_delay, max_delay],
+        "polling_mean_s": round(statistics.mean(polling), 3),
+        "polling_p95_s": round(sorted(polling)[int(trials * 0.95) - 1], 3),
+        "observer_mean_s": round(statistics.mean(observer), 3),
+        "observer_p95_s": round(sorted(observer)[int(trials * 0.95) - 1], 3),
+        "saved_per_wait_s": round(saved_per_wait, 3),
+        "waits_per_macro": waits_per_macro,
+        "saved_per_macro_s": round(saved_per_wait * waits_per_macro, 3),
+    }
+    print(json.dumps(summary, indent=2))
+    await closeBrowser()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=30)
+    parser.add_argument("--waits-per-macro", type=int, default=3)
+    parser.add_argument("--min-delay", type=int, default=50, help="earliest element insertion, ms")
+    parser.add_argument("--max-delay", type=int, default=600, help="latest element insertion, ms")
+    args = parser.parse_args()
+    asyncio.run(run(args.trials, args.waits_per_macro, args.min_delay, args.max_delay))
@@ -1,31 +1,47 @@
-import asyncio, os, time
+import asyncio, os, re, sys, time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
 import nodriver as uc
 from dotenv import load_dotenv
 
+from tabPool import pool_for, drop_pool, forget_tabs
+from waits import wait_for_element
+
 load_dotenv()
 
-browser = None
+# Browsers open at once, one per user; opening one more closes the least recently used idle one
+MAX_BROWSER_SESSIONS = int(os.getenv("MAX_BROWSER_SESSIONS", "4"))
+# Close a user's browser after this long unused (0 keeps it until evicted)
+SESSION_IDLE_S = float(os.getenv("SESSION_IDLE_S", "3600"))
+# Session of commands that carry no userId
+DEFAULT_SESSION = "default"
+# How long a login waiting for its OTP keeps its session from being evicted
+OTP_WAIT_S = float(os.getenv("OTP_WAIT_S", "300"))
+
 page = None
 
-async def wait_for_element(page, selector, timeout=30, check_interval=1):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            element = await page.query_selector(selector)
-            if element:
-                return element
-        except Exception:
-            pass
-        await asyncio.sleep(check_interval)
-    return None
+class BrowserSession:
+    """One user's browser, with its own profile, cookie jar and tab pool."""
 
-async def get_browser(force_new=False):
-    global browser
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.browser = None
+        self.last_used = time.monotonic()
+        self.pinned_until = 0
 
-    if force_new and browser:
-        await closeBrowser()
+    @property
+    def alive(self):
+        return self.browser is not None and not self.browser.stopped
 
-    if browser is None:
+    def profile_path(self):
+        # The default session keeps the configured profile; other users get one beside it
+        profile = os.getenv("USER_DATA_DIR", None)
+        if not profile or self.user_id == DEFAULT_SESSION:
+            return profile
+        return f"{profile}-{re.sub(r'[^A-Za-z0-9_.-]', '_', self.user_id)}"
+
+    async def start(self):
         headless = os.getenv("HEADLESS", "false").lower() in ("true", "1", "yes")
         print(f"Headless mode: {headless}")
 
@@ -33,11 +49,10 @@ async def get_browser(force_new=False):
             "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
             "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
         )
-        profile_path = os.getenv("USER_DATA_DIR", None)
 
-        browser = await uc.start(
+        self.browser = await uc.start(
             headless=headless,
-            user_data_dir=profile_path,
+            user_data_dir=self.profile_path(),
             browser_args=[
                 f"--user-agent={user_agent}",
                 "--no-sandbox",
@@ -51,24 +66,143 @@ async def get_browser(force_new=False):
             ],
             window_size=(1920, 1080)
         )
-    return browser
-
-
-async def get_main_tab():
-    b = await get_browser()
+        return self.browser
+
+    async def close(self):
+        if self.browser:
+            await forget_tabs(list(self.browser.tabs), unregister=False)
+            try:
+                await self.browser.stop()
+            except Exception:
+                pass
+            await drop_pool(self.browser)
+        self.browser = None
+
+class SessionRegistry:
+    """
+    Browser sessions by user id, most recently used last.
+
+    Every command runs in its user's own browser, so one valuer logging in or out leaves
+    the others' sessions and tasks alone. Sessions unused for `idle_s` seconds are
+    closed, and opening a session past `max_sessions` closes the least recently used
+    one not in use. A session is in use while a command holds it (see `hold`), while a
+    task leases its tabs, and while a login waits for its OTP (see `pin`).
+    """
+
+    def __init__(self, max_sessions=MAX_BROWSER_SESSIONS, idle_s=SESSION_IDLE_S):
+        self.max_sessions = max(1, max_sessions)
+        self.idle_s = idle_s
+        self._sessions = OrderedDict()
+        self._holds = {}
+        self._lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def hold(self, user_id=None):
+        """Keep `user_id`'s session from being evicted while the block runs."""
+        key = str(user_id or DEFAULT_SESSION)
+        self._holds[key] = self._holds.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            self._holds[key] -= 1
+            if not self._holds[key]:
+                del self._holds[key]
+
+    def pin(self, user_id=None, seconds=OTP_WAIT_S):
+        """Keep `user_id`'s session for `seconds` between commands (0 unpins it)."""
+        session = self._sessions.get(str(user_id or DEFAULT_SESSION))
+        if session:
+            session.pinned_until = time.monotonic() + seconds if seconds else 0
+
+    def in_use(self, key):
+        session = self._sessions.get(key)
+        if self._holds.get(key):
+            return True
+        if session is None or not session.alive:
+            return False
+        return session.pinned_until > time.monotonic() or pool_for(session.browser).in_use > 0
+
+    async def get(self, user_id=None, force_new=False):
+        """The browser of `user_id`'s session, started (or restarted with `force_new`) as needed."""
+        key = str(user_id or DEFAULT_SESSION)
+        async with self._lock:
+            session = self._sessions.get(key)
+            if session and (force_new or not session.alive):
+                await session.close()
+            if session is None:
+                await self._evict()
+                session = self._sessions[key] = BrowserSession(key)
+            if session.browser is None:
+                await session.start()
+            self._sessions.move_to_end(key)
+            session.last_used = time.monotonic()
+            return session.browser
+
+    async def close(self, user_id=None):
+        """Close `user_id`'s session; returns False if it had none."""
+        async with self._lock:
+            session = self._sessions.pop(str(user_id or DEFAULT_SESSION), None)
+            if session:
+                await session.close()
+            return session is not None
+
+    async def close_all(self):
+        async with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            for session in sessions:
+                await session.close()
+
+    async def _evict(self):
+        """Close idle sessions, then free a place for one more session if there is none."""
+        now = time.monotonic()
+        for key, session in list(self._sessions.items()):
+            if self.idle_s and now - session.last_used > self.idle_s and not self.in_use(key):
+                print(f"[SESSION] closing idle session {key}", file=sys.stderr)
+                await self._sessions.pop(key).close()
+
+        if len(self._sessions) < self.max_sessions:
+            return
+        for key, session in self._sessions.items():
+            if not self.in_use(key):
+                print(f"[SESSION] closing least recently used session {key}", file=sys.stderr)
+                await self._sessions.pop(key).close()
+                return
+        raise RuntimeError(f"All {self.max_sessions} browser sessions are in use, try again later")
+
+    def status(self):
+        now = time.monotonic()
+        return [
+            {"userId": key, "busy": self.in_use(key), "idle_s": round(now - session.last_used, 1)}
+            for key, session in self._sessions.items()
+        ]
+
+sessions = SessionRegistry()
+
+async def get_browser(force_new=False, user_id=None):
+    """The browser of `user_id`'s session (the default session when None)."""
+    return await sessions.get(user_id, force_new=force_new)
+
+
+async def get_main_tab(user_id=None):
+    b = await get_browser(user_id=user_id)
     if b.main_tab is None and len(b.tabs) > 0:
         return b.tabs[0]
     return b.main_tab or await b.get("about:blank")
 
 
-async def closeBrowser():
-    global browser, page
-    if browser:
-        try:
-            await browser.stop()
-        except Exception:
-            pass
-    browser, page = None, None
+async def closeBrowser(user_id=None):
+    """Close `user_id`'s browser (the default session's when None); False if it had none."""
+    global page
+    closed = await sessions.close(user_id)
+    page = None
+    return closed
+
+
+async def close_all_browsers():
+    global page
+    await sessions.close_all()
+    page = None
 
 
 def set_page(new_page):
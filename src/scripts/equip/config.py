@@ -0,0 +1,17 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Root of the qima site every equip flow navigates. Point it at qimaStub.py
+# (e.g. http://127.0.0.1:8765) to run the flows offline.
+QIMA_BASE_URL = os.getenv("QIMA_BASE_URL", "https://qima.taqeem.sa").rstrip("/")
+
+# Required: connection strings carry credentials and are never defaulted in code
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    raise RuntimeError("MONGO_URI is not set: put the MongoDB connection string in the environment or in .env")
+MONGO_DB = os.getenv("MONGO_DB", "projectForever")
+MONGO_MAX_POOL = int(os.getenv("MONGO_MAX_POOL", "20"))
+MONGO_MIN_POOL = int(os.getenv("MONGO_MIN_POOL", "2"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "10000"))
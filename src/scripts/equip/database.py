@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import sys
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from config import MONGO_URI, MONGO_DB, MONGO_MAX_POOL, MONGO_MIN_POOL, MONGO_TIMEOUT_MS
+from tracing import record_span
+
+_client = None
+_warmup = None
+
+# Worker-wide latency per "collection.operation"; a flow can also collect its own
+# share through `start_db_stats`, the same way readiness stats are gathered.
+_totals = {}
+db_stats = contextvars.ContextVar("db_stats", default=None)
+
+_TIMED = {
+    "find_one", "insert_one", "insert_many", "update_one", "update_many",
+    "delete_one", "delete_many", "bulk_write", "count_documents", "find_one_and_update",
+}
+
+def get_client():
+    """The worker's single Motor client, created on first use."""
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL,
+            minPoolSize=MONGO_MIN_POOL,
+            serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+            retryWrites=True,
+        )
+    return _client
+
+def _record(op, elapsed):
+    ms = elapsed * 1000
+    for stats in (_totals, db_stats.get()):
+        if stats is None:
+            continue
+        entry = stats.setdefault(op, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        entry["count"] += 1
+        entry["total_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+
+def start_db_stats():
+    stats = {}
+    db_stats.set(stats)
+    return stats
+
+def summarize_db_stats(stats=None):
+    """Count, mean and max latency (ms) per operation; worker-wide when `stats` is None."""
+    stats = _totals if stats is None else stats
+    return {
+        op: {
+            "count": entry["count"],
+            "mean_ms": round(entry["total_ms"] / entry["count"], 1),
+            "max_ms": round(entry["max_ms"], 1),
+        }
+        for op, entry in sorted(stats.items())
+    }
+
+class _TimedCursor:
+    def __init__(self, cursor, op):
+        self._cursor = cursor
+        self._op = op
+
+    async def to_list(self, length=None):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.to_list(length)
+        finally:
+            end = time.perf_counter()
+            _record(self._op, end - start)
+            record_span(f"db.{self._op}", start, end)
+
+    def __getattr__(self, name):
+        value = getattr(self._cursor, name)
+        if not callable(value):
+            return value
+
+        def chained(*args, **kwargs):
+            result = value(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chained
+
+class TimedCollection:
+    """Motor collection whose operations record their latency under "<collection>.<op>"."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return _TimedCursor(self._collection.find(*args, **kwargs), f"{self._collection.name}.find")
+
+    def __getattr__(self, name):
+        value = getattr(self._collection, name)
+        if name not in _TIMED:
+            return value
+
+        op = f"{self._collection.name}.{name}"
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await value(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                _record(op, end - start)
+                record_span(f"db.{op}", start, end)
+        return timed
+
+_collections = {}
+
+class _LazyDatabase:
+    """`db.<collection>` without connecting at import time."""
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        collection = _collections.get(name)
+        if collection is None:
+            collection = _collections[name] = TimedCollection(get_client()[MONGO_DB][name])
+        return collection
+
+db = _LazyDatabase()
+
+async def _ping():
+    start = time.perf_counter()
+    try:
+        await get_client().admin.command("ping")
+        _record("warmup.ping", time.perf_counter() - start)
+    except Exception as e:
+        print(f"[DB] warm-up failed: {e}", file=sys.stderr)
+
+def warm_up():
+    """Open the pool in the background so the first command does not pay for it."""
+    global _warmup
+    if _warmup is None:
+        _warmup = asyncio.create_task(_ping())
+    return _warmup
+
+def close_client():
+    global _client, _warmup
+    if _client is not None:
+        _client.close()
+    _client, _warmup = None, None
+    _collections.clear()
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import sys
+
+# "browser" keeps the page-load/inject/click path for every macro; "fetch" posts
+# macro edits from one tab with in-page fetch() and only falls back per macro.
+SUBMIT_ENGINE = os.getenv("MACRO_SUBMIT_ENGINE", "browser").lower()
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "6"))
+
+_INSTALL_JS = """
+(function() {
+    const findForm = (root) => {
+        const submit = root.querySelector("input[type='submit']");
+        return (submit && submit.form) || root.querySelector("form");
+    };
+    const form = findForm(document);
+    if (!form) return JSON.stringify({ ok: false, error: "Edit form not found" });
+
+    // Each submission loads the target macro's own edit form, so hidden and unmapped
+    // fields go back with the values the server holds for that macro
+    const engine = {
+        editUrl: location.href,
+        templateId: %s,
+    };
+
+    const setValue = (root, el, meta) => {
+        switch (meta.type) {
+            case "checkbox":
+                el.checked = Boolean(meta.value);
+                break;
+            case "select": {
+                let found = false;
+                for (const opt of el.options) {
+                    if (opt.value == meta.value || opt.text == meta.value) {
+                        el.value = opt.value;
+                        found = true;
+                        break;
+                    }
+                }
+                if (!found && el.options.length) el.selectedIndex = 0;
+                break;
+            }
+            case "radio":
+                for (const lbl of root.querySelectorAll("label.form-check-label")) {
+                    if ((lbl.textContent || "").trim() === meta.value) {
+                        const radio = root.querySelector("#" + CSS.escape(lbl.getAttribute("for") || ""));
+                        if (radio) radio.checked = true;
+                        break;
+                    }
+                }
+                break;
+            default:
+                el.value = meta.value ?? "";
+        }
+    };
+
+    window.__macroSubmit = async (macroId, data, extra) => {
+        const editUrl = engine.editUrl.replace("/macro/" + engine.templateId, "/macro/" + macroId);
+        let form, action, method;
+        try {
+            const page = await fetch(editUrl, { credentials: "same-origin", redirect: "follow" });
+            if (!page.ok || /\\/login|sso\\./.test(page.url)) {
+                return JSON.stringify({ macroId, status: page.status, url: page.url, ok: false, unmatched: [],
+                                        errors: ["Edit form could not be loaded"] });
+            }
+            const doc = new DOMParser().parseFromString(await page.text(), "text/html");
+            const loaded = findForm(doc);
+            if (!loaded) {
+                return JSON.stringify({ macroId, status: page.status, url: page.url, ok: false, unmatched: [],
+                                        errors: ["Edit form not found"] });
+            }
+            form = document.importNode(loaded, true);
+            action = new URL(loaded.getAttribute("action") || page.url, page.url).href;
+            method = (loaded.getAttribute("method") || "POST").toUpperCase();
+        } catch (err) {
+            return JSON.stringify({ macroId, status: 0, ok: false, unmatched: [], errors: [String(err)] });
+        }
+
+        const unmatched = [];
+        for (const [selector, meta] of Object.entries(data)) {
+            const el = form.querySelector(selector);
+            if (!el) { unmatched.push(selector); continue; }
+            setValue(form, el, meta);
+        }
+
+        const body = new FormData(form);
+        for (const [selector, value] of Object.entries(extra || {})) {
+            const el = form.querySelector(selector);
+            if (el && el.name) body.set(el.name, value);
+            else unmatched.push(selector);
+        }
+
+        try {
+            const res = await fetch(action, { method, body, credentials: "same-origin", redirect: "follow" });
+            const html = await res.text();
+            const doc = new DOMParser().parseFromString(html, "text/html");
+            const errors = [...doc.querySelectorAll("div.alert.alert-danger, .invalid-feedback")]
+                .map(n => (n.textContent || "").trim())
+                .filter(Boolean);
+            const path = new URL(res.url).pathname;
+            const backOnForm = /\\/edit\\/?$/.test(path);
+            const onLogin = /\\/login|sso\\./.test(res.url);
+            return JSON.stringify({
+                macroId, status: res.status, url: res.url, unmatched,
+                errors: errors.slice(0, 5),
+                ok: res.ok && !errors.length && !backOnForm && !onLogin,
+            });
+        } catch (err) {
+            return JSON.stringify({ macroId, status: 0, ok: false, unmatched, errors: [String(err)] });
+        }
+    };
+
+    return JSON.stringify({
+        ok: true,
+        editUrl: engine.editUrl,
+        hasToken: !!form.querySelector("[name='_token']"),
+    });
+})()
+"""
+
+def _parse(raw):
+    if isinstance(raw, str):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            pass
+    return {"ok": False, "errors": [f"Unexpected evaluate result: {raw!r}"]}
+
+class FetchSubmitter:
+    """
+    Submits macro edit forms from a single authenticated tab.
+
+    `install` must run while the tab shows a macro edit page; its URL is the pattern for
+    the other macros. Every submission GETs that macro's own edit form, sets only the
+    mapped fields and POSTs it with fetch(), so session cookies go along and hidden or
+    unmapped fields keep the values the server holds.
+    """
+
+    def __init__(self, page, concurrency=FETCH_CONCURRENCY):
+        self.page = page
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def install(self, template_macro_id):
+        info = _parse(await self.page.evaluate(
+            _INSTALL_JS % json.dumps(str(template_macro_id)), return_by_value=True
+        ))
+        if not info.get("ok"):
+            print(f"[FETCH ENGINE] install failed: {info}", file=sys.stderr)
+            return False
+        if not info.get("hasToken"):
+            print("[FETCH ENGINE] no CSRF token in edit form, submissions will likely be rejected", file=sys.stderr)
+        return True
+
+    async def submit(self, macro_id, data, extra=None):
+        """POST one macro; returns {"ok", "status", "url", "errors", "unmatched"}."""
+        async with self.semaphore:
+            try:
+                raw = await self.page.evaluate(
+                    f"window.__macroSubmit({json.dumps(str(macro_id))}, {json.dumps(data)}, {json.dumps(extra or {})})",
+                    await_promise=True,
+                    return_by_value=True,
+                )
+            except Exception as e:
+                return {"ok": False, "macroId": str(macro_id), "status": 0, "errors": [str(e)]}
+        return _parse(raw)
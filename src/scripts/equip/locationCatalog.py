@@ -0,0 +1,213 @@
+import asyncio
+import difflib
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+
+from locationMapper import region_codes, city_codes
+from tracing import span
+
+# Region/city codes crawled from a qima form, kept on disk between runs
+LOCATION_CATALOG_PATH = os.getenv(
+    "LOCATION_CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "location_catalog.json")
+)
+LOCATION_CATALOG_TTL_H = float(os.getenv("LOCATION_CATALOG_TTL_H", "168"))
+# How long the crawl waits for #city to be rebuilt after each region change
+LOCATION_CRAWL_TIMEOUT_MS = int(os.getenv("LOCATION_CRAWL_TIMEOUT_MS", "3000"))
+# Wait before crawling again after a crawl found nothing
+LOCATION_CRAWL_RETRY_S = 600
+# Lowest difflib ratio accepted for a fuzzy name match
+LOCATION_MATCH_CUTOFF = float(os.getenv("LOCATION_MATCH_CUTOFF", "0.8"))
+
+_TASHKEEL = re.compile(r"[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_PREFIXES = re.compile(r"^(منطقه|محافظه|مدينه)\s+")
+
+def normalize_name(text):
+    """NFKC, no diacritics or tatweel, one form of alef/ya/ta marbuta, no "منطقة"-style prefix."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", str(text))
+    text = _TASHKEEL.sub("", text)
+    text = re.sub("[أإآٱ]", "ا", text).replace("ى", "ي").replace("ة", "ه")
+    text = re.sub(r"\s+", " ", text).strip().lower()
+    return _PREFIXES.sub("", text)
+
+# Walks every #region option in one evaluate and reads the #city options it loads. A
+# region whose cities do not change within the timeout is listed in `skipped` with no
+# entry: #city may still hold the previous region's list.
+_CRAWL_JS = """
+(async (timeoutMs) => {
+    const region = document.querySelector("#region");
+    const city = document.querySelector("#city");
+    if (!region || !city) return JSON.stringify({ ok: false, error: "no #region/#city on page" });
+
+    const options = (el) => [...el.options].filter(o => o.value).map(o => [o.value, o.text.trim()]);
+    const change = (el, value) => {
+        if (window.$) { window.$(el).val(value).trigger("change"); return; }
+        el.value = value;
+        el.dispatchEvent(new Event("change", { bubbles: true }));
+    };
+    const citiesChanged = (before) => new Promise(resolve => {
+        let quiet, changed = false;
+        const done = () => { observer.disconnect(); clearTimeout(timer); clearTimeout(quiet); resolve(changed); };
+        const observer = new MutationObserver(() => {
+            if (JSON.stringify(options(city)) === before) return;
+            changed = true;
+            clearTimeout(quiet);
+            quiet = setTimeout(done, 100);
+        });
+        const timer = setTimeout(done, timeoutMs);
+        observer.observe(city, { childList: true, subtree: true });
+    });
+
+    const original = region.value;
+    const regions = {}, cities = {}, skipped = [];
+    for (const [code, name] of options(region)) {
+        regions[code] = name;
+        const changed = citiesChanged(JSON.stringify(options(city)));
+        change(region, code);
+        if (await changed) cities[code] = Object.fromEntries(options(city));
+        else skipped.push(code);
+    }
+    change(region, original);
+    return JSON.stringify({ ok: true, regions, cities, skipped });
+})
+"""
+
+class LocationCatalog:
+    """
+    Every region and city code of the qima location selects, by name.
+
+    Crawled once from any form with #region/#city and saved to `path`; refreshed by the
+    next `ensure` after `ttl_h` hours. Lookups match names exactly, then normalized
+    (see normalize_name), then by containment, then fuzzily; the codes in
+    locationMapper seed the catalog before the first crawl.
+    """
+
+    def __init__(self, path=LOCATION_CATALOG_PATH, ttl_h=LOCATION_CATALOG_TTL_H):
+        self.path = path
+        self.ttl_s = ttl_h * 3600
+        self.regions = {}
+        self.cities = {}
+        self.updated_at = 0
+        self._lock = asyncio.Lock()
+        self._loaded = False
+        self._failed_at = None
+
+    @property
+    def stale(self):
+        return not self.cities or time.time() - self.updated_at > self.ttl_s
+
+    def load(self):
+        if self._loaded:
+            return self
+        self._loaded = True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.regions = data.get("regions", {})
+            self.cities = data.get("cities", {})
+            self.updated_at = data.get("updated_at", 0)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"[LOCATION] could not read {self.path}: {e}", file=sys.stderr)
+        return self
+
+    def save(self):
+        data = {"updated_at": self.updated_at, "regions": self.regions, "cities": self.cities}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[LOCATION] could not write {self.path}: {e}", file=sys.stderr)
+
+    async def refresh(self, page):
+        """Crawl the catalog from the form open in `page`. Returns False if the page has no location selects."""
+        with span("location.crawl", page):
+            raw = await page.evaluate(f"{_CRAWL_JS}({LOCATION_CRAWL_TIMEOUT_MS})", await_promise=True, return_by_value=True)
+        try:
+            data = json.loads(raw)
+        except (TypeError, ValueError):
+            data = {"ok": False, "error": f"unexpected crawl result: {raw!r}"}
+        if not data.get("ok") or not data.get("cities"):
+            print(f"[LOCATION] crawl failed: {data.get('error', 'no regions')}", file=sys.stderr)
+            return False
+
+        # Regions whose cities did not load in time keep what an earlier crawl found, if anything
+        skipped = data.get("skipped") or []
+        cities = {**{code: self.cities[code] for code in skipped if code in self.cities}, **data["cities"]}
+        self.regions, self.cities, self.updated_at = data["regions"], cities, time.time()
+        self.save()
+        print(f"[LOCATION] catalog refreshed: {len(self.regions)} regions, "
+              f"{sum(len(c) for c in self.cities.values())} cities", file=sys.stderr)
+        if skipped:
+            print(f"[LOCATION] cities of regions {skipped} did not load within {LOCATION_CRAWL_TIMEOUT_MS} ms",
+                  file=sys.stderr)
+        return True
+
+    async def ensure(self, page):
+        """Load the catalog, crawling it from `page` first if it is missing or older than the TTL."""
+        self.load()
+        if not self._due():
+            return self
+        async with self._lock:
+            if self._due() and not await self.refresh(page):
+                self._failed_at = time.monotonic()
+        return self
+
+    def _due(self):
+        recently_failed = self._failed_at and time.monotonic() - self._failed_at < LOCATION_CRAWL_RETRY_S
+        return self.stale and not recently_failed
+
+    def region_code(self, name):
+        return _match(name, {**{c: n for n, c in region_codes.items()}, **self.regions})
+
+    def city_code(self, name, region_code=None):
+        if region_code and region_code in self.cities:
+            candidates = self.cities[region_code]
+        else:
+            candidates = {c: n for n, c in city_codes.items()}
+            for cities in self.cities.values():
+                candidates.update(cities)
+        return _match(name, candidates)
+
+    def lookup(self, region_name, city_name):
+        """(region code, city code) for the names; either is None when nothing matches."""
+        region_code = self.region_code(region_name)
+        return region_code, self.city_code(city_name, region_code)
+
+    def city_name(self, region_code, city_code):
+        return self.cities.get(region_code, {}).get(city_code)
+
+def _match(name, candidates):
+    """Code in `candidates` ({code: name}) whose name best matches `name`."""
+    if not name or not candidates:
+        return None
+    name = str(name).strip()
+    for code, candidate in candidates.items():
+        if candidate == name:
+            return code
+
+    wanted = normalize_name(name)
+    if not wanted:
+        return None
+    normalized = {code: normalize_name(candidate) for code, candidate in candidates.items()}
+    for code, candidate in normalized.items():
+        if candidate == wanted:
+            return code
+    contained = [code for code, candidate in normalized.items() if candidate and (wanted in candidate or candidate in wanted)]
+    if contained:
+        return min(contained, key=lambda code: abs(len(normalized[code]) - len(wanted)))
+
+    best = difflib.get_close_matches(wanted, list(normalized.values()), n=1, cutoff=LOCATION_MATCH_CUTOFF)
+    if not best:
+        return None
+    return next(code for code, candidate in normalized.items() if candidate == best[0])
+
+location_catalog = LocationCatalog()
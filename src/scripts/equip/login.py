@@ -53,7 +53,7 @@ async def startLogin(page, email, password, record_id=None):
         print(json.dumps(msg), flush=True)
         return msg
 
-async def submitOtp(page, otp, record_id=None):
+async def submitOtp(page, otp, record_id=None, user_id=None):
     if not page:
         msg = {"status": "FAILED", "recordId": record_id, "error": "No login session"}
         print(json.dumps(msg), flush=True)
@@ -62,7 +62,7 @@ async def submitOtp(page, otp, record_id=None):
     try:
         otp_input = await wait_for_element(page, "#otp, input[type='tel'], input[name='otp'], #emailCode, #verificationCode", 30)
         if not otp_input:
-            await closeBrowser()
+            await closeBrowser(user_id)
             msg = {"status": "FAILED", "recordId": record_id, "error": "OTP input not found"}
             print(json.dumps(msg), flush=True)
             return msg
@@ -85,7 +85,7 @@ async def submitOtp(page, otp, record_id=None):
                 break
 
         if not verify_btn:
-            await closeBrowser()
+            await closeBrowser(user_id)
             msg = {"status": "FAILED", "recordId": record_id, "error": "Verify button not found"}
             print(json.dumps(msg), flush=True)
             return msg
@@ -110,13 +110,13 @@ async def submitOtp(page, otp, record_id=None):
             print(json.dumps(msg), flush=True)
             return msg
 
-        await closeBrowser()
+        await closeBrowser(user_id)
         msg = {"status": "FAILED", "recordId": record_id, **nav_result}
         print(json.dumps(msg), flush=True)
         return msg
 
     except Exception as e:
-        await closeBrowser()
+        await closeBrowser(user_id)
         tb = traceback.format_exc()
         msg = {"status": "FAILED", "recordId": record_id, "error": str(e), "traceback": tb}
         print(json.dumps(msg), flush=True)
@@ -1,7 +1,129 @@
 import asyncio
+import json
+import os
 import re
+import sys
+
+from config import QIMA_BASE_URL
+from fetchSubmit import FETCH_CONCURRENCY
+from readiness import navigate
+from tabPool import borrowed_lease
+from tracing import span
 
 lock1 = asyncio.Lock()
+_MACRO_EDIT_URL = rf"({re.escape(QIMA_BASE_URL)}/report/macro/\d+/edit)"
+
+INCOMPLETE_STATUS = "غير مكتملة"
+
+# "fetch" verifies macro show pages with concurrent in-page fetch() from one tab;
+# "browser" opens each show page in a tab.
+VERIFY_ENGINE = os.getenv("MACRO_VERIFY_ENGINE", "fetch").lower()
+VERIFY_CONCURRENCY = int(os.getenv("VERIFY_CONCURRENCY", "10"))
+# Element holding a show page's status; unset searches the whole page, as the browser check does
+MACRO_STATUS_SELECTOR = os.getenv("MACRO_STATUS_SELECTOR", "")
+
+# id (column 1) and status (column 6) of #m-table rows
+_ROWS_JS = """
+    const macroRows = (trs) => trs.map(tr => {
+        const link = tr.querySelector("td:nth-child(1) a");
+        const status = tr.querySelector("td:nth-child(6)");
+        return link ? { id: parseInt(link.textContent.trim(), 10), status: (status ? status.textContent : "").trim() } : null;
+    }).filter(row => row && !isNaN(row.id));
+"""
+
+# Reads every row of the report's #m-table from the server-rendered HTML of each outer
+# page (DataTables has not paged it yet there), fetching pages 2..N concurrently.
+_REPORT_MACROS_JS = """
+(async () => {
+    const base = %s;
+    const limit = %d;
+""" + _ROWS_JS + """
+    const load = async (n) => {
+        const res = await fetch(base + "?page=" + n, { credentials: "same-origin" });
+        if (!res.ok) throw new Error("HTTP " + res.status + " on page " + n);
+        return new DOMParser().parseFromString(await res.text(), "text/html");
+    };
+    const rows = (doc) => macroRows([...doc.querySelectorAll("#m-table tbody tr")]);
+    const lastPage = (doc) => {
+        const nums = [...doc.querySelectorAll("ul.pagination li")]
+            .map(li => parseInt(li.textContent.trim(), 10))
+            .filter(n => !isNaN(n));
+        return nums.length ? Math.max(...nums) : 1;
+    };
+    try {
+        const first = await load(1);
+        const pages = lastPage(first);
+        const byPage = [rows(first)];
+        let next = 2;
+        const worker = async () => {
+            while (next <= pages) {
+                const n = next++;
+                byPage[n - 1] = rows(await load(n));
+            }
+        };
+        await Promise.all(Array.from({ length: Math.min(limit, pages - 1) }, worker));
+        return JSON.stringify({ ok: true, pages, macros: byPage.flat() });
+    } catch (err) {
+        return JSON.stringify({ ok: false, error: String(err) });
+    }
+})()
+"""
+
+# Status of each macro's show page, from the status element only when one is configured;
+# otherwise, or on pages without that element, the page is searched whole as the browser
+# check does.
+_MACRO_STATUS_JS = """
+(async () => {
+    const ids = %s;
+    const base = %s;
+    const selector = %s;
+    const incomplete = %s;
+    const limit = %d;
+    const out = {};
+    let next = 0;
+    const worker = async () => {
+        while (next < ids.length) {
+            const id = ids[next++];
+            try {
+                const res = await fetch(base + "/report/macro/" + id + "/show", { credentials: "same-origin" });
+                if (!res.ok) { out[id] = { error: "HTTP " + res.status }; continue; }
+                const doc = new DOMParser().parseFromString(await res.text(), "text/html");
+                const el = selector ? doc.querySelector(selector) : null;
+                const text = el ? el.textContent.trim() : null;
+                out[id] = {
+                    status: text,
+                    incomplete: (text !== null ? text : (doc.body ? doc.body.textContent : "")).includes(incomplete),
+                };
+            } catch (err) {
+                out[id] = { error: String(err) };
+            }
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(limit, ids.length) }, worker));
+    return JSON.stringify(out);
+})()
+"""
+
+# Rows of the outer page currently loaded, all DataTables sub-pages at once: through the
+# DataTables API with the page length set to "all" when it is there, else from the DOM.
+_LOADED_TABLE_JS = """
+(() => {
+""" + _ROWS_JS + """
+    const table = document.querySelector("#m-table");
+    if (!table) return JSON.stringify({ ok: false, error: "#m-table not found" });
+    const $ = window.jQuery;
+    let trs;
+    if ($ && $.fn && $.fn.dataTable && $.fn.dataTable.isDataTable(table)) {
+        const api = $(table).DataTable();
+        api.page.len(-1).draw(false);
+        trs = api.rows().nodes().toArray();
+    } else {
+        trs = [...table.querySelectorAll("tbody tr")];
+    }
+    const next = document.querySelector("ul.pagination li:last-child a");
+    return JSON.stringify({ ok: true, macros: macroRows(trs), next: next ? next.href : null });
+})()
+"""
 
 # ------------------------------
 # Helpers
@@ -34,19 +156,101 @@ async def safe_query_selector_all(page, selector, max_wait=10):
 # Macro Fetching
 # ------------------------------
 
-async def get_macro_pages_num(browser, report_id):
-    page = await browser.get(f"https://qima.taqeem.sa/report/{report_id}")
-    await asyncio.sleep(1)
-    li = await safe_query_selector_all(page, "ul.pagination > li > *")
-    if li:
-        try:
-            last_text = await li[-2].text_content()
-            page_no = int(last_text)
-        except Exception:
+async def fetch_report_macros(page, report_id, concurrency=FETCH_CONCURRENCY):
+    """
+    Every macro of a report as [{"id", "status", "incomplete"}], in table order, read
+    with in-page fetch() from `page` (which must be on a logged-in qima page).
+    Returns None if the report pages could not be read.
+    """
+    with span("macros.fetch", page):
+        raw = await page.evaluate(
+            _REPORT_MACROS_JS % (json.dumps(f"{QIMA_BASE_URL}/report/{report_id}"), max(1, concurrency)),
+            await_promise=True,
+            return_by_value=True,
+        )
+    try:
+        result = json.loads(raw)
+    except (TypeError, ValueError):
+        result = {"ok": False, "error": f"Unexpected evaluate result: {raw!r}"}
+    if not result.get("ok"):
+        print(f"[MACROS] reading report {report_id} failed: {result.get('error')}", file=sys.stderr)
+        return None
+    for macro in result["macros"]:
+        macro["incomplete"] = INCOMPLETE_STATUS in macro["status"]
+    return result["macros"]
+
+async def fetch_macro_statuses(page, macro_ids, concurrency=VERIFY_CONCURRENCY):
+    """
+    {macro_id: {"status", "incomplete"}} for `macro_ids`, read from their show pages with
+    in-page fetch() from `page` (on a logged-in qima page). Macros whose page could not be
+    read are missing from the result.
+    """
+    macro_ids = [int(macro_id) for macro_id in macro_ids]
+    if not macro_ids:
+        return {}
+    raw = await page.evaluate(
+        _MACRO_STATUS_JS % (
+            json.dumps(macro_ids), json.dumps(QIMA_BASE_URL), json.dumps(MACRO_STATUS_SELECTOR),
+            json.dumps(INCOMPLETE_STATUS), max(1, concurrency),
+        ),
+        await_promise=True,
+        return_by_value=True,
+    )
+    try:
+        result = json.loads(raw)
+    except (TypeError, ValueError):
+        print(f"[MACROS] status fetch failed: unexpected evaluate result {raw!r}", file=sys.stderr)
+        return {}
+
+    statuses = {}
+    for macro_id, entry in result.items():
+        if "error" in entry:
+            print(f"[MACROS] status of macro {macro_id} not read: {entry['error']}", file=sys.stderr)
+            continue
+        statuses[int(macro_id)] = entry
+    return statuses
+
+async def read_report_macros(page, report_id):
+    """
+    `fetch_report_macros`, falling back to reading the table of each outer page in turn
+    (one evaluate per page) when the pages cannot be fetched. `page` is left on the report.
+    """
+    await navigate(page, f"{QIMA_BASE_URL}/report/{report_id}", replaces=1)
+    macros = await fetch_report_macros(page, report_id)
+    if macros is not None:
+        return macros
+
+    macros, seen = [], set()
+    while True:
+        result = json.loads(await page.evaluate(_LOADED_TABLE_JS, return_by_value=True))
+        if not result.get("ok"):
+            print(f"[MACROS] reading report {report_id} table failed: {result.get('error')}", file=sys.stderr)
+            break
+        macros.extend(result["macros"])
+        seen.add(await page.evaluate("window.location.href"))
+        if not result["next"] or result["next"] in seen:
+            break
+        await navigate(page, result["next"], replaces=1)
+
+    for macro in macros:
+        macro["incomplete"] = INCOMPLETE_STATUS in macro["status"]
+    return macros
+
+async def get_macro_pages_num(browser, report_id, lease=None):
+    """(outer page count, page showing the report) for `report_id`, on the lease's main tab."""
+    async with borrowed_lease(browser, lease) as lease:
+        page = await lease.main()
+        await navigate(page, f"{QIMA_BASE_URL}/report/{report_id}", replaces=1)
+        li = await safe_query_selector_all(page, "ul.pagination > li > *")
+        if li:
+            try:
+                last_text = await li[-2].text_content()
+                page_no = int(last_text)
+            except Exception:
+                page_no = 1
+        else:
             page_no = 1
-    else:
-        page_no = 1
-    return page_no, page
+        return page_no, page
 
 async def get_macros_from_page(page):
     urls = []
@@ -58,7 +262,7 @@ async def get_macros_from_page(page):
     # Scrape current page for macro edit URLs
     html_content = await page.get_content()
     await asyncio.sleep(1)
-    urls.extend(re.findall(r"(https://qima\.taqeem\.sa/report/macro/\d+/edit)", html_content))
+    urls.extend(re.findall(_MACRO_EDIT_URL, html_content))
 
     # If next button exists and is not disabled, click and scrape next page
     if "disabled" not in await next_buttons[0].get_html():
@@ -67,14 +271,18 @@ async def get_macros_from_page(page):
 
         html_content = await page.get_content()
         await asyncio.sleep(1)
-        urls.extend(re.findall(r"(https://qima\.taqeem\.sa/report/macro/\d+/edit)", html_content))
+        urls.extend(re.findall(_MACRO_EDIT_URL, html_content))
 
     return urls
 
-async def get_macros(browser, report_id, assets_data, browsers_num=5):
+async def get_macros(browser, report_id, assets_data, browsers_num=5, lease=None):
+    async with borrowed_lease(browser, lease) as lease:
+        return await _get_macros(browser, report_id, assets_data, browsers_num, lease)
+
+async def _get_macros(browser, report_id, assets_data, browsers_num, lease):
 
     assets_data_url = [
-        f'https://qima.taqeem.sa/report/macro/{d["id"]}/edit'
+        f'{QIMA_BASE_URL}/report/macro/{d["id"]}/edit'
         for d in assets_data
         if d.get("id") and str(d["id"]).strip()  
     ]
@@ -82,17 +290,13 @@ async def get_macros(browser, report_id, assets_data, browsers_num=5):
         return assets_data_url
 
     # 2️⃣ Otherwise fetch from report pages
-    pages_num, first_page = await get_macro_pages_num(browser, report_id)
+    pages_num, _ = await get_macro_pages_num(browser, report_id, lease=lease)
     macros_urls = []
 
-    semaphore = asyncio.Semaphore(browsers_num)
-    empty_indexes = [1] * browsers_num
-    pages = [first_page]
-
-    # Open extra tabs only if browsers_num > 1
-    for _ in range(max(0, browsers_num - 1)):
-        p = await browser.get("about:blank", new_tab=True)
-        pages.append(p)
+    # Tabs come from the task's lease (the main tab first); the pool may grant fewer
+    pages = await lease.acquire(max(1, min(browsers_num, pages_num)))
+    semaphore = asyncio.Semaphore(len(pages))
+    empty_indexes = [1] * len(pages)
 
     async def limited_task(page_no):
         async with semaphore:
@@ -101,7 +305,7 @@ async def get_macros(browser, report_id, assets_data, browsers_num=5):
                 empty_indexes[index] = 0
 
             page = await go_to_url(
-                pages, index, f"https://qima.taqeem.sa/report/{report_id}?page={page_no}"
+                pages, index, f"{QIMA_BASE_URL}/report/{report_id}?page={page_no}"
             )
             await asyncio.sleep(0.5)
             macros_urls.extend(await get_macros_from_page(page))
@@ -114,9 +318,4 @@ async def get_macros(browser, report_id, assets_data, browsers_num=5):
         tasks = [limited_task(i + 1) for i in range(pages_num)]
         await asyncio.gather(*tasks)
 
-    # cleanup extra tabs
-    for p in pages[1:]:
-        await p.close()
-
     return macros_urls
-
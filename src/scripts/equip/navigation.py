@@ -1,9 +1,10 @@
+from config import QIMA_BASE_URL
 from browser import wait_for_element
 import asyncio
 
 async def post_login_navigation(page):
     try:
-        translate = await wait_for_element(page, "a[href='https://qima.taqeem.sa/setlocale/en']", timeout=10)
+        translate = await wait_for_element(page, f"a[href='{QIMA_BASE_URL}/setlocale/en']", timeout=10)
         if not translate:
             return {"status": "FAILED", "error": "Translate link not found"}
 
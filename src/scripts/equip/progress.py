@@ -0,0 +1,128 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+
+# Counter updates (events with `current`) per report go out at most this often
+PROGRESS_RATE_HZ = float(os.getenv("PROGRESS_RATE_HZ", "2"))
+THROUGHPUT_WINDOW_S = float(os.getenv("PROGRESS_THROUGHPUT_WINDOW_S", "60"))
+# Rate samples kept per report and status, and reports whose seq is remembered
+MAX_RATE_SAMPLES = 256
+MAX_TRACKED_REPORTS = 1000
+
+# Sent at once, after anything still pending for the report, even when they carry `current`
+TERMINAL_STATUSES = {"COMPLETE", "FAILED", "STOPPED"}
+TERMINAL_SUFFIXES = ("_COMPLETE", "_FAILED", "_ERROR")
+
+def is_terminal(status):
+    return status in TERMINAL_STATUSES or status.endswith(TERMINAL_SUFFIXES)
+
+class ProgressChannel:
+    """
+    Progress lines for Node, which forwards them to Socket.IO.
+
+    Counter updates (per-macro events carrying `current`) are coalesced per report: the
+    latest one is sent on the next tick, ticks being at most `rate_hz` per second, with
+    the number of updates it stands for in `coalesced`. Every other event goes out at
+    once, after the report's pending update so the order is kept. Each line carries a
+    per-report `seq`, and counter updates a rolling `throughput_per_min` and `eta_s`.
+    The tick loop only runs while updates are pending; rate samples are dropped when a
+    report ends, and seqs of the least recently active reports past
+    `MAX_TRACKED_REPORTS` are forgotten.
+    """
+
+    def __init__(self, rate_hz=PROGRESS_RATE_HZ, window_s=THROUGHPUT_WINDOW_S, stream=None):
+        self.interval = 1 / rate_hz if rate_hz > 0 else 0
+        self.window_s = window_s
+        self.stream = stream
+        self._seq = OrderedDict()
+        self._pending = {}
+        self._samples = {}
+        self._ticker = None
+
+    def emit(self, status, message, report_id, **kwargs):
+        event = {"type": "PROGRESS", "status": status, "message": message, "reportId": report_id, **kwargs}
+        counter = "current" in kwargs and not is_terminal(status)
+        if counter:
+            self._measure(report_id, event)
+
+        if counter and self.interval and self._start_ticker():
+            previous = self._pending.get(report_id)
+            event["coalesced"] = (previous.get("coalesced", 1) + 1) if previous else 1
+            self._pending[report_id] = event
+            return
+
+        self._flush_report(report_id)
+        self._write(report_id, event)
+        if status in TERMINAL_STATUSES:
+            for key in [key for key in self._samples if key[0] == report_id]:
+                del self._samples[key]
+
+    def flush(self):
+        for report_id in list(self._pending):
+            self._flush_report(report_id)
+
+    def _flush_report(self, report_id):
+        event = self._pending.pop(report_id, None)
+        if event is not None:
+            self._write(report_id, event)
+
+    def _write(self, report_id, event):
+        seq = self._seq.get(report_id, 0) + 1
+        self._seq[report_id] = seq
+        self._seq.move_to_end(report_id)
+        while len(self._seq) > MAX_TRACKED_REPORTS:
+            self._seq.popitem(last=False)
+        event["seq"] = seq
+        print(json.dumps(event), file=self.stream or sys.stdout, flush=True)
+
+    def _measure(self, report_id, event):
+        """Rolling rate of `current` for this report and status, and the ETA it gives."""
+        now = time.monotonic()
+        key = (report_id, event["status"])
+        samples = self._samples.get(key)
+        current = event.get("current") or 0
+        if samples is None or (samples and current < samples[-1][1]):
+            samples = self._samples[key] = deque(maxlen=MAX_RATE_SAMPLES)
+        samples.append((now, current))
+        while len(samples) > 2 and now - samples[0][0] > self.window_s:
+            samples.popleft()
+
+        (first_t, first_n), (last_t, last_n) = samples[0], samples[-1]
+        if last_t > first_t and last_n > first_n:
+            per_s = (last_n - first_n) / (last_t - first_t)
+            event["throughput_per_min"] = round(per_s * 60, 1)
+            total = event.get("total")
+            if total:
+                event["eta_s"] = round(max(0, total - last_n) / per_s)
+
+    def _start_ticker(self):
+        """Run the tick loop on the current event loop; False outside one (emit directly)."""
+        if self._ticker is not None and not self._ticker.done():
+            return True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        self._ticker = loop.create_task(self._tick())
+        return True
+
+    async def _tick(self):
+        """Send pending updates every interval; ends once a tick finds nothing pending."""
+        try:
+            while self._pending:
+                await asyncio.sleep(self.interval)
+                self.flush()
+        finally:
+            self.flush()
+
+progress = ProgressChannel()
+
+def emit_progress(status, message, reportId, **kwargs):
+    """Emit progress updates that Node.js will forward to Socket.IO clients"""
+    progress.emit(status, message, reportId, **kwargs)
+
+def flush_progress():
+    progress.flush()
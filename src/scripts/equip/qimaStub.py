@@ -0,0 +1,510 @@
+"""
+Local stand-in for the qima pages the equip flows drive, for offline end-to-end runs
+and throughput benchmarks.
+
+It serves report creation (/report/create/4/487), asset creation
+(/report/asset/create/{id}), macro edit/show pages, and the report page with its
+outer pagination, a DataTables-style #m-table (10 rows per sub-page, #m-table_next)
+and the "غير مكتملة" status column. Form fields are generated from formSteps2, so
+the stub always matches the selectors the fillers use. Every response is delayed by
+`--latency-ms` plus up to `--jitter-ms` to stand in for the real server.
+
+    python qimaStub.py --port 8765 --latency-ms 150 --jitter-ms 100
+    QIMA_BASE_URL=http://127.0.0.1:8765 node app.js
+
+Unknown report ids are created on first visit to their asset page, so without-base
+records can point at any report_id. GET /__stats returns report and macro counts.
+"""
+import argparse
+import email
+import email.policy
+import html
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from formSteps2 import form_steps, macro_form_config
+
+INCOMPLETE = "غير مكتملة"
+COMPLETE = "مكتملة"
+
+CSRF_TOKEN = "stub-csrf-token"
+
+# A macro is "complete" once these edit-form fields are filled in.
+REQUIRED_MACRO_FIELDS = ("asset_name", "asset_usage_id", "inspected_at", "value", "region", "city")
+# Saving without these is rejected with a validation error, like qima does.
+MANDATORY_MACRO_FIELDS = ("asset_name", "value")
+
+COUNTRIES = {"1": "المملكة العربية السعودية"}
+REGIONS = {
+    "1": ("منطقة الرياض", {"3": "الرياض", "4": "الخرج", "5": "الدرعية"}),
+    "2": ("منطقة مكة المكرمة", {"6": "مكة المكرمة", "7": "جدة", "8": "الطائف"}),
+    "3": ("المنطقة الشرقية", {"9": "الدمام", "10": "الخبر", "11": "الجبيل"}),
+    "4": ("منطقة المدينة المنورة", {"12": "المدينة المنورة", "13": "ينبع"}),
+    "5": ("منطقة القصيم", {"14": "بريدة", "15": "عنيزة"}),
+}
+ALL_CITIES = {code: name for _, cities in REGIONS.values() for code, name in cities.items()}
+SELECT_OPTIONS = {str(i): f"خيار {i}" for i in range(1, 6)}
+REPORT_TYPES = ("تقرير مفصل", "ملخص التقرير", "مراجعة مع قيمة جديدة", "مراجعة بدون قيمة جديدة")
+
+_SELECTOR_RE = re.compile(r"\[(name|id)='([^']+)'\]")
+
+class QimaState:
+    """Reports and macros held in memory; ids are allocated like qima's, increasing globally."""
+
+    def __init__(self, fail_rate=0.0):
+        self.lock = threading.Lock()
+        self.fail_rate = fail_rate
+        self.reports = {}
+        self.macros = {}
+        self.errors = {}
+        self.next_report_id = 1600000
+        self.next_macro_id = 9000000
+        self.requests = 0
+
+    def create_report(self, fields=None, report_id=None):
+        with self.lock:
+            if report_id is None:
+                report_id = self.next_report_id
+                self.next_report_id += 1
+            self.reports.setdefault(int(report_id), {"fields": fields or {}, "macros": []})
+            return int(report_id)
+
+    def add_macros(self, report_id, count):
+        with self.lock:
+            report = self.reports.setdefault(report_id, {"fields": {}, "macros": []})
+            ids = list(range(self.next_macro_id, self.next_macro_id + count))
+            self.next_macro_id += count
+            for macro_id in ids:
+                self.macros[macro_id] = {"report": report_id, "fields": {}}
+            report["macros"].extend(ids)
+            return ids
+
+    def is_complete(self, macro_id):
+        fields = self.macros[macro_id]["fields"]
+        return all(str(fields.get(name, "")).strip() for name in REQUIRED_MACRO_FIELDS)
+
+    def save_macro(self, macro_id, fields):
+        """Store a macro edit; returns a validation error message, or None on success."""
+        missing = [name for name in MANDATORY_MACRO_FIELDS if not str(fields.get(name, "")).strip()]
+        if missing:
+            return "الحقول التالية مطلوبة: " + "، ".join(missing)
+        if self.fail_rate and random.random() < self.fail_rate:
+            return "حدث خطأ أثناء الحفظ، يرجى المحاولة مرة أخرى"
+        with self.lock:
+            self.macros[macro_id]["fields"] = {k: v for k, v in fields.items() if not k.startswith("_")}
+        return None
+
+    def stats(self):
+        with self.lock:
+            complete = sum(1 for macro_id in self.macros if self.is_complete(macro_id))
+            return {
+                "reports": len(self.reports),
+                "macros": len(self.macros),
+                "complete": complete,
+                "incomplete": len(self.macros) - complete,
+                "requests": self.requests,
+            }
+
+    def report_stats(self, report_id):
+        with self.lock:
+            ids = self.reports.get(int(report_id), {}).get("macros", [])
+            complete = sum(1 for macro_id in ids if self.is_complete(macro_id))
+            return {"macros": len(ids), "complete": complete, "incomplete": len(ids) - complete}
+
+# ------------------------------
+# HTML
+# ------------------------------
+
+def _esc(value):
+    return html.escape(str(value), quote=True)
+
+def _options(options, selected=None, placeholder=True):
+    out = ['<option value="">اختر</option>'] if placeholder else []
+    for value, text in options.items():
+        sel = " selected" if str(selected) == value else ""
+        out.append(f'<option value="{_esc(value)}"{sel}>{_esc(text)}</option>')
+    return "".join(out)
+
+def _field(selector, ftype, values):
+    """Render the input a formSteps2 selector/type pair expects."""
+    match = _SELECTOR_RE.search(selector)
+    if not match:
+        return ""
+    key = match.group(2)
+    ident = f'name="{_esc(key)}" id="{_esc(key)}"'
+    value = values.get(key, "")
+
+    if ftype == "location":
+        # select2 renders these spans next to the real selects emitted by _location_fields
+        return f'<span id="{_esc(key)}"></span>'
+    if ftype in ("select", "dynamic_select"):
+        return f'<select {ident}>{_options(SELECT_OPTIONS, value)}</select>'
+    if ftype == "radio":
+        radios = []
+        for i, text in enumerate(REPORT_TYPES, 1):
+            checked = " checked" if value == text else ""
+            radios.append(
+                f'<input type="radio" class="form-check-input" id="{_esc(key)}_{i}" name="{_esc(key)}" value="{_esc(text)}"{checked}>'
+                f'<label class="form-check-label" for="{_esc(key)}_{i}">{_esc(text)}</label>'
+            )
+        return "".join(radios)
+    if ftype == "checkbox":
+        checked = " checked" if value else ""
+        return f'<input type="checkbox" {ident} value="1"{checked}>'
+    if ftype == "file":
+        return f'<input type="file" {ident}>'
+    if ftype == "date":
+        return f'<input type="date" {ident} value="{_esc(value)}">'
+    return f'<input type="text" {ident} value="{_esc(value)}">'
+
+def _location_fields(values):
+    return f"""
+    <select id="country_id" name="country_id">{_options(COUNTRIES, values.get("country_id"))}</select>
+    <select id="region" name="region">{_options({c: n for c, (n, _) in REGIONS.items()}, values.get("region"))}</select>
+    <select id="city" name="city">{_options(ALL_CITIES, values.get("city"))}</select>
+    <script>
+    document.getElementById("region").addEventListener("change", async (e) => {{
+        const city = document.getElementById("city");
+        const keep = city.value;
+        const res = await fetch("/api/cities?region=" + encodeURIComponent(e.target.value));
+        const cities = await res.json();
+        city.innerHTML = '<option value="">اختر</option>' +
+            Object.entries(cities).map(([v, t]) => `<option value="${{v}}">${{t}}</option>`).join("");
+        if (keep in cities) city.value = keep;
+    }});
+    </script>
+    """
+
+def _form_fields(field_map, field_types, values):
+    rows = []
+    for key, selector in field_map.items():
+        ftype = field_types.get(key, "text")
+        rows.append(f'<div class="form-group">{_field(selector, ftype, values)}</div>')
+    return "".join(rows)
+
+def _layout(base, title, body, error=None):
+    alert = f'<div class="alert alert-danger">{_esc(error)}</div>' if error else ""
+    return f"""<!DOCTYPE html>
+<html lang="ar" dir="rtl"><head><meta charset="utf-8"><title>{_esc(title)}</title></head>
+<body>
+<nav>
+  <a href="{base}/setlocale/ar">العربية</a>
+  <a href="{base}/setlocale/en">English</a>
+</nav>
+<main>{alert}{body}</main>
+</body></html>"""
+
+def _report_create_page(base, values, error=None):
+    step = form_steps[0]
+    body = f"""
+    <form method="POST" action="{base}/report/create/4/487" enctype="multipart/form-data">
+      <input type="hidden" name="_token" value="{CSRF_TOKEN}">
+      {_form_fields(step["field_map"], step["field_types"], values)}
+      <input type="submit" name="continue" value="استمرار">
+    </form>"""
+    return _layout(base, "إنشاء تقرير", body, error)
+
+def _asset_create_page(base, report_id):
+    body = f"""
+    <form method="POST" action="{base}/report/asset/create/{report_id}">
+      <input type="hidden" name="_token" value="{CSRF_TOKEN}">
+      <input type="number" id="macros" name="macros" min="1">
+      <input type="submit" value="حفظ">
+    </form>"""
+    return _layout(base, "إضافة أصول", body)
+
+def _macro_edit_page(base, macro_id, values, error=None):
+    body = f"""
+    <form method="POST" action="{base}/report/macro/{macro_id}/update" enctype="multipart/form-data">
+      <input type="hidden" name="_token" value="{CSRF_TOKEN}">
+      <input type="hidden" name="_method" value="PUT">
+      {_form_fields(macro_form_config["field_map"], macro_form_config["field_types"], values)}
+      {_location_fields(values)}
+      <input type="submit" value="حفظ">
+    </form>"""
+    return _layout(base, f"تعديل الأصل {macro_id}", body, error)
+
+def _macro_show_page(base, macro_id, values, complete):
+    status = COMPLETE if complete else INCOMPLETE
+    rows = "".join(f"<tr><th>{_esc(k)}</th><td>{_esc(v)}</td></tr>" for k, v in values.items())
+    body = f"""
+    <h1>الأصل {macro_id}</h1>
+    <span class="badge" id="macro-status">{status}</span>
+    <table class="table"><tbody>{rows}</tbody></table>
+    <a href="{base}/report/macro/{macro_id}/edit">تعديل</a>"""
+    return _layout(base, f"الأصل {macro_id}", body)
+
+# Client-side paging in the shape of DataTables: rows outside the current sub-page are
+# detached from the DOM and #m-table_next carries "disabled" on the last sub-page.
+_DATATABLE_JS = """
+(function() {
+    const table = document.getElementById("m-table");
+    const tbody = table.tBodies[0];
+    const rows = [...tbody.rows];
+    const length = %d;
+    let page = 0;
+    const pages = Math.max(1, Math.ceil(rows.length / length));
+    const wrap = document.createElement("div");
+    wrap.className = "dataTables_paginate paging_simple_numbers";
+    wrap.id = "m-table_paginate";
+    const prev = document.createElement("a");
+    prev.id = "m-table_previous";
+    prev.textContent = "السابق";
+    const next = document.createElement("a");
+    next.id = "m-table_next";
+    next.textContent = "التالي";
+    wrap.append(prev, next);
+    table.after(wrap);
+    const draw = () => {
+        tbody.replaceChildren(...rows.slice(page * length, (page + 1) * length));
+        prev.className = "paginate_button previous" + (page === 0 ? " disabled" : "");
+        next.className = "paginate_button next" + (page >= pages - 1 ? " disabled" : "");
+    };
+    prev.addEventListener("click", () => { if (page > 0) { page--; draw(); } });
+    next.addEventListener("click", () => { if (page < pages - 1) { page++; draw(); } });
+    draw();
+})();
+"""
+
+def _pagination(base, report_id, page, pages):
+    if pages <= 1:
+        return ""
+    items = []
+    if page > 1:
+        items.append(f'<li class="page-item"><a class="page-link" href="{base}/report/{report_id}?page={page - 1}" rel="prev">&lsaquo;</a></li>')
+    else:
+        items.append('<li class="page-item disabled"><span class="page-link">&lsaquo;</span></li>')
+    for n in range(1, pages + 1):
+        if n == page:
+            items.append(f'<li class="page-item active"><span class="page-link">{n}</span></li>')
+        else:
+            items.append(f'<li class="page-item"><a class="page-link" href="{base}/report/{report_id}?page={n}">{n}</a></li>')
+    if page < pages:
+        items.append(f'<li class="page-item"><a class="page-link" href="{base}/report/{report_id}?page={page + 1}" rel="next">&rsaquo;</a></li>')
+    else:
+        items.append('<li class="page-item disabled"><span class="page-link">&rsaquo;</span></li>')
+    return f'<ul class="pagination">{"".join(items)}</ul>'
+
+def _report_page(base, state, report_id, page, per_page, table_length):
+    report = state.reports[report_id]
+    ids = report["macros"]
+    pages = max(1, -(-len(ids) // per_page))
+    page = min(max(1, page), pages)
+
+    rows = []
+    for macro_id in ids[(page - 1) * per_page:page * per_page]:
+        fields = state.macros[macro_id]["fields"]
+        status = COMPLETE if state.is_complete(macro_id) else INCOMPLETE
+        rows.append(
+            f'<tr><td><a href="{base}/report/macro/{macro_id}/edit">{macro_id}</a></td>'
+            f'<td>{_esc(fields.get("asset_name", ""))}</td><td>{_esc(fields.get("asset_type", ""))}</td>'
+            f'<td>{_esc(fields.get("value", ""))}</td><td>{_esc(fields.get("inspected_at", ""))}</td>'
+            f'<td>{status}</td><td><a href="{base}/report/macro/{macro_id}/show">عرض</a></td></tr>'
+        )
+
+    all_complete = ids and all(state.is_complete(macro_id) for macro_id in ids)
+    delete = '<button id="delete_report" type="button">حذف التقرير</button>' if all_complete else ""
+    body = f"""
+    <h1>التقرير {report_id}</h1>
+    {delete}
+    <table id="m-table" class="table">
+      <thead><tr><th>#</th><th>الاسم</th><th>النوع</th><th>القيمة</th><th>تاريخ المعاينة</th><th>الحالة</th><th></th></tr></thead>
+      <tbody>{"".join(rows)}</tbody>
+    </table>
+    {_pagination(base, report_id, page, pages)}
+    <script>{_DATATABLE_JS % table_length}</script>"""
+    return _layout(base, f"التقرير {report_id}", body)
+
+# ------------------------------
+# Server
+# ------------------------------
+
+def _parse_body(handler):
+    length = int(handler.headers.get("Content-Length") or 0)
+    raw = handler.rfile.read(length) if length else b""
+    ctype = handler.headers.get("Content-Type", "")
+
+    if ctype.startswith("multipart/form-data"):
+        msg = email.message_from_bytes(
+            f"Content-Type: {ctype}\r\n\r\n".encode() + raw, policy=email.policy.HTTP
+        )
+        fields = {}
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name and not part.get_filename():
+                fields[name] = part.get_content().strip() if part.get_content_type() == "text/plain" else ""
+        return fields
+
+    return {k: v[-1] for k, v in parse_qs(raw.decode("utf-8"), keep_blank_values=True).items()}
+
+class QimaHandler(BaseHTTPRequestHandler):
+    server_version = "QimaStub/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    @property
+    def base(self):
+        return f"http://{self.headers.get('Host') or '%s:%d' % self.server.server_address}"
+
+    def _delay(self):
+        stub = self.server
+        with stub.state.lock:
+            stub.state.requests += 1
+        delay = stub.latency_ms + random.uniform(0, stub.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _send(self, status, body, ctype="text/html; charset=utf-8", headers=None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _redirect(self, path):
+        self._send(302, "", headers={"Location": f"{self.base}{path}"})
+
+    def _not_found(self):
+        self._send(404, _layout(self.base, "404", "<h1>404</h1>"))
+
+    def do_GET(self):
+        self._delay()
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip("/") or "/"
+        state = self.server.state
+
+        if path == "/":
+            return self._send(200, _layout(self.base, "qima", "<h1>لوحة التحكم</h1>"))
+        if path == "/__stats":
+            return self._send(200, json.dumps(state.stats()), "application/json")
+        if m := re.fullmatch(r"/__stats/report/(\d+)", path):
+            return self._send(200, json.dumps(state.report_stats(m.group(1))), "application/json")
+        if path.startswith("/setlocale/"):
+            referer = urlsplit(self.headers.get("Referer", "/"))
+            return self._redirect(referer.path + (f"?{referer.query}" if referer.query else ""))
+        if path == "/api/cities":
+            region = REGIONS.get(query.get("region", [""])[0])
+            return self._send(200, json.dumps(region[1] if region else {}, ensure_ascii=False), "application/json")
+        if path == "/report/create/4/487":
+            return self._send(200, _report_create_page(self.base, {}))
+        if m := re.fullmatch(r"/report/asset/create/(\d+)", path):
+            report_id = state.create_report(report_id=m.group(1))
+            return self._send(200, _asset_create_page(self.base, report_id))
+        if m := re.fullmatch(r"/report/macro/(\d+)/(edit|show)", path):
+            macro_id = int(m.group(1))
+            if macro_id not in state.macros:
+                return self._not_found()
+            values = state.macros[macro_id]["fields"]
+            if m.group(2) == "show":
+                return self._send(200, _macro_show_page(self.base, macro_id, values, state.is_complete(macro_id)))
+            with state.lock:
+                error = state.errors.pop(macro_id, None)
+            return self._send(200, _macro_edit_page(self.base, macro_id, values, error))
+        if m := re.fullmatch(r"/report/(\d+)", path):
+            report_id = int(m.group(1))
+            if report_id not in state.reports:
+                return self._not_found()
+            page = int(query.get("page", ["1"])[0] or 1)
+            return self._send(200, _report_page(self.base, state, report_id, page,
+                                                self.server.per_page, self.server.table_length))
+        return self._not_found()
+
+    def do_POST(self):
+        self._delay()
+        path = urlsplit(self.path).path.rstrip("/")
+        state = self.server.state
+        fields = _parse_body(self)
+
+        if path == "/report/create/4/487":
+            if not fields.get("title", "").strip():
+                return self._send(200, _report_create_page(self.base, fields, "حقل العنوان مطلوب"))
+            report_id = state.create_report(fields)
+            return self._redirect(f"/report/asset/create/{report_id}")
+        if m := re.fullmatch(r"/report/asset/create/(\d+)", path):
+            try:
+                count = int(fields.get("macros", ""))
+            except ValueError:
+                count = 0
+            if count < 1:
+                return self._redirect(path)
+            report_id = int(m.group(1))
+            state.add_macros(report_id, count)
+            return self._redirect(f"/report/{report_id}")
+        if m := re.fullmatch(r"/report/macro/(\d+)/update", path):
+            macro_id = int(m.group(1))
+            if macro_id not in state.macros:
+                return self._not_found()
+            error = state.save_macro(macro_id, fields)
+            if error:
+                with state.lock:
+                    state.errors[macro_id] = error
+                return self._redirect(f"/report/macro/{macro_id}/edit")
+            return self._redirect(f"/report/macro/{macro_id}/show")
+        return self._not_found()
+
+class QimaStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=8765, latency_ms=0, jitter_ms=0, fail_rate=0.0,
+                 per_page=20, table_length=10, verbose=False):
+        super().__init__((host, port), QimaHandler)
+        self.state = QimaState(fail_rate)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.per_page = per_page
+        self.table_length = table_length
+        self.verbose = verbose
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a background thread, e.g. inside a benchmark process."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def add_stub_arguments(parser):
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=150, help="fixed delay added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="extra random delay, 0..jitter")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of valid macro saves rejected")
+    parser.add_argument("--per-page", type=int, default=20, help="macros per report page")
+    parser.add_argument("--table-length", type=int, default=10, help="rows per #m-table sub-page")
+
+def stub_from_args(args, verbose=False):
+    return QimaStub(args.host, args.port, args.latency_ms, args.jitter_ms, args.fail_rate,
+                    args.per_page, args.table_length, verbose=verbose)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_stub_arguments(parser)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    stub = stub_from_args(args, verbose=args.verbose)
+    print(f"qima stub on {stub.base_url} (latency {args.latency_ms}+{args.jitter_ms} ms)")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        stub.server_close()
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import random
+import sys
+
+VALIDATION = "validation"
+NETWORK = "network"
+SESSION_EXPIRED = "session_expired"
+TARGET_CRASHED = "target_crashed"
+UNKNOWN = "unknown"
+
+# Retries allowed per failure class, on top of the first attempt
+RETRY_BUDGETS = {
+    VALIDATION: int(os.getenv("RETRY_VALIDATION", "2")),
+    NETWORK: int(os.getenv("RETRY_NETWORK", "3")),
+    SESSION_EXPIRED: int(os.getenv("RETRY_SESSION_EXPIRED", "1")),
+    TARGET_CRASHED: int(os.getenv("RETRY_TARGET_CRASHED", "2")),
+    UNKNOWN: int(os.getenv("RETRY_UNKNOWN", "2")),
+}
+
+# First backoff per class in seconds; it doubles per retry, capped, with full jitter
+BACKOFF_BASE_S = {VALIDATION: 0.5, NETWORK: 1.0, SESSION_EXPIRED: 3.0, TARGET_CRASHED: 0.5, UNKNOWN: 1.0}
+BACKOFF_MAX_S = float(os.getenv("RETRY_BACKOFF_MAX_S", "15"))
+
+_LOGIN_MARKERS = ("sso.taqeem.gov.sa", "/login", "openid-connect")
+
+_CRASH_MARKERS = (
+    "target closed", "no target with given id", "target crashed", "inspected target navigated or closed",
+    "session closed", "websocket", "connection closed", "no session with given id",
+)
+_NETWORK_MARKERS = (
+    "timeout", "timed out", "net::err", "connection reset", "connection refused", "temporarily unavailable",
+    "http 5", "bad gateway", "service unavailable",
+)
+_SESSION_MARKERS = ("session expired", "unauthenticated", "http 401", "http 419", "login")
+
+class ValidationError(Exception):
+    """The server sent the form back with errors."""
+
+class SessionExpiredError(Exception):
+    """The qima session is gone: pages redirect to the login screen."""
+
+def classify(error):
+    """Failure class of an exception or of the error string of a FAILED result."""
+    if isinstance(error, ValidationError):
+        return VALIDATION
+    if isinstance(error, SessionExpiredError):
+        return SESSION_EXPIRED
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return NETWORK
+
+    text = str(error).lower()
+    if any(marker in text for marker in _CRASH_MARKERS):
+        return TARGET_CRASHED
+    if any(marker in text for marker in _SESSION_MARKERS):
+        return SESSION_EXPIRED
+    if any(marker in text for marker in _NETWORK_MARKERS):
+        return NETWORK
+    if "alert-danger" in text or "validation" in text:
+        return VALIDATION
+    return UNKNOWN
+
+def backoff(failure_class, retry):
+    """Seconds to wait before retry number `retry` (1-based) of a failure of `failure_class`."""
+    ceiling = min(BACKOFF_MAX_S, BACKOFF_BASE_S.get(failure_class, 1.0) * 2 ** (retry - 1))
+    return random.uniform(0, ceiling)
+
+async def check_session(page):
+    """Raise SessionExpiredError if `page` ended up on the login screen."""
+    try:
+        url = await page.evaluate("window.location.href")
+    except Exception:
+        return
+    if isinstance(url, str) and any(marker in url for marker in _LOGIN_MARKERS):
+        raise SessionExpiredError(f"Redirected to login: {url}")
+
+class RetryPolicy:
+    """
+    Per-class retry budgets for one work item. `failed(error)` records a failure (of
+    `failure_class`, when the caller already knows it) and returns (failure_class,
+    delay) when the item may be retried after `delay` seconds, or (failure_class, None)
+    once that class's budget is spent.
+    """
+
+    def __init__(self, budgets=None):
+        self.budgets = {**RETRY_BUDGETS, **(budgets or {})}
+        self.tries = {}
+
+    def failed(self, error, failure_class=None):
+        failure_class = failure_class or classify(error)
+        retry = self.tries.get(failure_class, 0) + 1
+        self.tries[failure_class] = retry
+        if retry > self.budgets.get(failure_class, 0):
+            return failure_class, None
+        return failure_class, backoff(failure_class, retry)
+
+async def retry_inline(operation, budgets=None, label=""):
+    """
+    Call `operation()` until it returns, retrying failures it raises within their class
+    budget after a jittered backoff. The last failure is re-raised. Stops are never retried.
+    """
+    from worker_equip import TaskStoppedException
+
+    policy = RetryPolicy(budgets)
+    while True:
+        try:
+            return await operation()
+        except TaskStoppedException:
+            raise
+        except Exception as e:
+            failure_class, delay = policy.failed(e)
+            if delay is None:
+                raise
+            print(f"[RETRY] {label} {failure_class} failure, retrying in {delay:.1f}s: {e}", file=sys.stderr)
+            await asyncio.sleep(delay)
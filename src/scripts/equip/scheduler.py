@@ -0,0 +1,177 @@
+import asyncio
+import itertools
+import os
+import time
+import uuid
+
+# Jobs run at once per worker, and jobs allowed to wait before new ones are refused
+MAX_RUNNING_JOBS = int(os.getenv("MAX_RUNNING_JOBS", "2"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "20"))
+# Assumed duration of an action no job has finished yet, for start estimates
+DEFAULT_JOB_S = float(os.getenv("DEFAULT_JOB_S", "300"))
+
+INTERACTIVE = 0
+BULK = 1
+
+# Lower runs first; actions not listed are bulk
+ACTION_PRIORITY = {
+    "check": INTERACTIVE,
+    "checkMacros": INTERACTIVE,
+    "formFill2": BULK,
+    "resumeFormFill2": BULK,
+    "retryMacros": BULK,
+    "addAssets": BULK,
+    "formFill": BULK,
+}
+
+class Job:
+    def __init__(self, cmd, seq):
+        self.id = uuid.uuid4().hex
+        # The task id pause/stop address the job by once it runs
+        self.cmd = {**cmd, "taskId": cmd.get("taskId") or cmd.get("recordId") or self.id}
+        self.seq = seq
+        self.action = cmd.get("action")
+        self.user_id = cmd.get("userId") or "anonymous"
+        self.report_id = cmd.get("reportId") or cmd.get("recordId")
+        self.priority = ACTION_PRIORITY.get(self.action, BULK)
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.task = None
+
+    def describe(self, **extra):
+        return {
+            "jobId": self.id,
+            "taskId": self.cmd["taskId"],
+            "action": self.action,
+            "userId": self.user_id,
+            "reportId": self.report_id,
+            "priority": "interactive" if self.priority == INTERACTIVE else "bulk",
+            **extra,
+        }
+
+class JobScheduler:
+    """
+    Runs worker commands at most `max_running` at a time, holding the rest in a queue of
+    at most `max_queued`. The next job is the oldest one of the highest priority class
+    whose user has the fewest jobs running, then the fewest started since the user last
+    had nothing queued, so one user's batch of fills cannot hold back other users.
+    `run(cmd)` is awaited for every job started.
+    """
+
+    def __init__(self, run, max_running=MAX_RUNNING_JOBS, max_queued=MAX_QUEUED_JOBS):
+        self.run = run
+        self.max_running = max(1, max_running)
+        self.max_queued = max_queued
+        self.waiting = []
+        self.running = {}
+        self.durations = {}
+        self.served = {}
+        self._seq = itertools.count()
+
+    def submit(self, cmd):
+        """Queue `cmd` and start whatever may start. Returns the job, or None if the queue is full."""
+        if len(self.waiting) >= self.max_queued:
+            return None
+        job = Job(cmd, next(self._seq))
+        self.waiting.append(job)
+        self._pump()
+        return job
+
+    def cancel(self, task_id=None, report_id=None):
+        """Drop a job that has not started yet; returns it, or None if none matched."""
+        for job in self.waiting:
+            if (task_id and task_id in (job.id, job.cmd["taskId"])) or \
+                    (report_id and job.report_id == report_id):
+                self.waiting.remove(job)
+                return job
+        return None
+
+    def find(self, report_id, actions=None):
+        """A waiting or running job for `report_id` (of one of `actions`, if given); None if there is none."""
+        for job in [*self.waiting, *self.running.values()]:
+            if job.report_id == report_id and (actions is None or job.action in actions):
+                return job
+        return None
+
+    def place(self, job):
+        """(1-based position in start order, estimated seconds to start) of a waiting job; None once started."""
+        for index, (queued, eta) in enumerate(self._start_estimates()):
+            if queued is job:
+                return index + 1, round(eta)
+        return None
+
+    def status(self):
+        now = time.monotonic()
+        running = [
+            job.describe(running_s=round(now - job.started_at, 1))
+            for job in self.running.values()
+        ]
+        queued = [
+            job.describe(position=index + 1, waiting_s=round(now - job.queued_at, 1), eta_s=round(eta))
+            for index, (job, eta) in enumerate(self._start_estimates())
+        ]
+        return {
+            "status": "QUEUE_STATUS",
+            "depth": len(self.waiting),
+            "maxQueued": self.max_queued,
+            "maxRunning": self.max_running,
+            "running": running,
+            "queued": queued,
+        }
+
+    def _expected_s(self, action):
+        samples = self.durations.get(action)
+        return sum(samples) / len(samples) if samples else DEFAULT_JOB_S
+
+    def _start_estimates(self):
+        """(job, seconds until it should start) for the waiting jobs, in start order."""
+        now = time.monotonic()
+        slots = sorted(
+            max(0.0, self._expected_s(job.action) - (now - job.started_at)) for job in self.running.values()
+        )
+        slots += [0.0] * (self.max_running - len(slots))
+        estimates = []
+        for job in self._start_order():
+            slots.sort()
+            start = slots[0]
+            slots[0] = start + self._expected_s(job.action)
+            estimates.append((job, start))
+        return estimates
+
+    def _start_order(self):
+        """Waiting jobs in the order they would start if nothing else arrived."""
+        running_per_user = {}
+        for job in self.running.values():
+            running_per_user[job.user_id] = running_per_user.get(job.user_id, 0) + 1
+        served = dict(self.served)
+        waiting, order = list(self.waiting), []
+        while waiting:
+            job = min(waiting, key=lambda j: (
+                j.priority, running_per_user.get(j.user_id, 0), served.get(j.user_id, 0), j.seq
+            ))
+            waiting.remove(job)
+            order.append(job)
+            running_per_user[job.user_id] = running_per_user.get(job.user_id, 0) + 1
+            served[job.user_id] = served.get(job.user_id, 0) + 1
+        return order
+
+    def _pump(self):
+        while self.waiting and len(self.running) < self.max_running:
+            job = self._start_order()[0]
+            self.waiting.remove(job)
+            job.started_at = time.monotonic()
+            self.running[job.id] = job
+            self.served[job.user_id] = self.served.get(job.user_id, 0) + 1
+            job.task = asyncio.create_task(self._run(job))
+
+    async def _run(self, job):
+        try:
+            await self.run(job.cmd)
+        finally:
+            self.running.pop(job.id, None)
+            samples = self.durations.setdefault(job.action, [])
+            samples.append(time.monotonic() - job.started_at)
+            del samples[:-20]
+            if not any(j.user_id == job.user_id for j in [*self.waiting, *self.running.values()]):
+                self.served.pop(job.user_id, None)
+            self._pump()
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import os
+import sys
+import uuid
+
+# Worker processes run by worker_equip.py; 1 runs the worker in-process as before
+EQUIP_WORKERS = int(os.getenv("EQUIP_WORKERS", "1"))
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker_equip.py")
+# Longest stdout line read from a worker (results can carry every step and span)
+LINE_LIMIT = 64 * 1024 * 1024
+QUEUE_STATUS_TIMEOUT_S = 2.0
+
+# Lines that end a job, freeing its share of the worker's load
+FINAL_STATUSES = {"SUCCESS", "FAILED", "STOPPED", "QUEUE_FULL", "NOT_FOUND"}
+_SESSION_EXPORT = "session-export"
+_SESSION_IMPORT = "session-import"
+# Attempts at applying a user's cookies to a worker before giving up on it
+SESSION_IMPORT_ATTEMPTS = 3
+
+def _print(event):
+    print(json.dumps(event), flush=True)
+
+class WorkerProcess:
+    """One worker_equip.py child with its own browser and profile, and the jobs sent to it."""
+
+    def __init__(self, index):
+        self.index = index
+        self.proc = None
+        self.jobs = {}
+        self.closing = False
+
+    @property
+    def load(self):
+        """Tabs asked for by the jobs in flight here."""
+        return sum(int(cmd.get("tabsNum", 3) or 3) for cmd in self.jobs.values())
+
+    async def start(self, on_line, on_exit):
+        env = {**os.environ, "EQUIP_WORKERS": "1", "EQUIP_WORKER_INDEX": str(self.index)}
+        profile = os.getenv("USER_DATA_DIR")
+        if profile:
+            env["USER_DATA_DIR"] = f"{profile}-{self.index}"
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=os.path.dirname(WORKER_SCRIPT),
+            env=env,
+            limit=LINE_LIMIT,
+        )
+        asyncio.create_task(self._read(on_line, on_exit))
+
+    async def _read(self, on_line, on_exit):
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                break
+            on_line(self, line)
+        await self.proc.wait()
+        await on_exit(self)
+
+    async def send(self, cmd):
+        self.proc.stdin.write((json.dumps(cmd) + "\n").encode())
+        await self.proc.stdin.drain()
+
+class Supervisor:
+    """
+    Runs N worker processes behind the worker's stdin/stdout protocol, so Node sees one
+    worker. Jobs go to the worker with the least load (tabs of the jobs in flight);
+    pause/resume/stop follow the job to its worker; login and OTP run on worker 0, and the
+    user's session cookies are then copied to that user's session on every other worker.
+    Worker output is forwarded line for line, except the internal session lines, the
+    per-worker queue status, which is merged into one, and the extra CLOSED replies when
+    one user's sessions are closed.
+    """
+
+    def __init__(self, count):
+        self.workers = [WorkerProcess(i) for i in range(count)]
+        self.tasks = {}
+        self.reports = {}
+        self.cookies = {}
+        self.logins = set()
+        self.closing = False
+        self._statuses = None
+
+    async def start(self):
+        for worker in self.workers:
+            await worker.start(self.on_line, self.on_exit)
+
+    def pick(self):
+        return min(self.workers, key=lambda w: (w.load, len(w.jobs), w.index))
+
+    def owner(self, task_id=None, report_id=None):
+        return self.tasks.get(task_id) or self.reports.get(report_id)
+
+    async def dispatch(self, cmd, worker=None):
+        """Send a job to `worker` (default: the least loaded) and account for it until its final line."""
+        cmd = {**cmd, "taskId": cmd.get("taskId") or cmd.get("recordId") or uuid.uuid4().hex}
+        worker = worker or self.pick()
+        worker.jobs[cmd["taskId"]] = cmd
+        self.tasks[cmd["taskId"]] = worker
+        report_id = cmd.get("reportId") or cmd.get("recordId")
+        if report_id:
+            self.reports[report_id] = worker
+        await worker.send(cmd)
+
+    async def handle(self, cmd):
+        action = cmd.get("action")
+
+        if action in ("login", "otp"):
+            self.logins.add(cmd.get("userId"))
+            await self.workers[0].send(cmd)
+
+        elif action in ("pause", "resume", "stop"):
+            worker = self.owner(cmd.get("taskId"), cmd.get("reportId"))
+            if worker is None and action == "resume" and cmd.get("reportId"):
+                # Not running anywhere: the worker resumes it from its checkpoint as a new job
+                await self.dispatch(cmd)
+            else:
+                await (worker or self.workers[0]).send(cmd)
+
+        elif action == "queueStatus":
+            self._statuses = {}
+            for worker in self.workers:
+                await worker.send(cmd)
+            asyncio.create_task(self._merge_statuses())
+
+        elif action == "close" and cmd.get("userId"):
+            # Every worker may hold a session of this user; worker 0's reply answers Node
+            self.cookies.pop(cmd["userId"], None)
+            for worker in self.workers:
+                await worker.send(cmd)
+
+        elif action == "close":
+            self.closing = True
+            for worker in self.workers:
+                worker.closing = True
+                await worker.send(cmd)
+            await asyncio.gather(*[w.proc.wait() for w in self.workers])
+            _print({"status": "CLOSED"})
+
+        else:
+            await self.dispatch(cmd)
+
+    def on_line(self, worker, line):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            event = None
+
+        if isinstance(event, dict) and event.get("type") != "PROGRESS":
+            status = event.get("status")
+            task_id = event.get("taskId")
+
+            if status == "SESSION" and task_id == _SESSION_EXPORT:
+                user_id = event.get("userId")
+                self.cookies[user_id] = event.get("cookies") or []
+                asyncio.create_task(self._share_session(user_id, exclude=worker))
+                return
+            if status == "SESSION_IMPORT_FAILED" and task_id == _SESSION_IMPORT:
+                self.import_failed(worker, event)
+                return
+            if status == "SESSION_IMPORTED" or (status == "CLOSED" and (self.closing or worker.index != 0)):
+                return
+            if status == "QUEUE_STATUS" and self._statuses is not None:
+                self._statuses[worker.index] = event
+                return
+
+            # The worker's own login reply carries the userId; the one printed by login.py does not
+            user_id = event.get("userId")
+            if worker.index == 0 and "userId" in event and user_id in self.logins and not task_id \
+                    and status in ("LOGIN_SUCCESS", "SUCCESS"):
+                self.logins.discard(user_id)
+                asyncio.create_task(worker.send(
+                    {"action": "exportSession", "taskId": _SESSION_EXPORT, "userId": user_id}
+                ))
+            if status in FINAL_STATUSES and task_id in worker.jobs:
+                self.finished(worker, task_id)
+
+        sys.stdout.buffer.write(line if line.endswith(b"\n") else line + b"\n")
+        sys.stdout.flush()
+
+    def finished(self, worker, task_id):
+        cmd = worker.jobs.pop(task_id)
+        self.tasks.pop(task_id, None)
+        report_id = cmd.get("reportId") or cmd.get("recordId")
+        still_running = any((c.get("reportId") or c.get("recordId")) == report_id for c in worker.jobs.values())
+        if self.reports.get(report_id) is worker and not still_running:
+            del self.reports[report_id]
+
+    async def on_exit(self, worker):
+        if worker.closing:
+            return
+        print(f"[SUPERVISOR] worker {worker.index} exited ({worker.proc.returncode}), restarting", file=sys.stderr)
+        for task_id, cmd in list(worker.jobs.items()):
+            _print({
+                "status": "FAILED",
+                "error": f"Worker process {worker.index} exited",
+                "taskId": task_id,
+                "reportId": cmd.get("reportId") or cmd.get("recordId"),
+            })
+            self.finished(worker, task_id)
+        await worker.start(self.on_line, self.on_exit)
+        for user_id in list(self.cookies):
+            await self.import_session(worker, user_id)
+
+    async def import_session(self, worker, user_id, attempt=1):
+        if user_id in self.cookies:
+            await worker.send({"action": "importSession", "cookies": self.cookies[user_id], "userId": user_id,
+                               "taskId": _SESSION_IMPORT, "attempt": attempt})
+
+    def import_failed(self, worker, event):
+        user_id, attempt = event.get("userId"), event.get("attempt", 1)
+        print(f"[SUPERVISOR] session of {user_id} not applied on worker {worker.index} "
+              f"(attempt {attempt}): {event.get('error')}", file=sys.stderr)
+        if attempt < SESSION_IMPORT_ATTEMPTS:
+            asyncio.create_task(self.import_session(worker, user_id, attempt + 1))
+
+    async def _share_session(self, user_id, exclude):
+        for worker in self.workers:
+            if worker is not exclude:
+                await self.import_session(worker, user_id)
+
+    async def _merge_statuses(self):
+        deadline = asyncio.get_running_loop().time() + QUEUE_STATUS_TIMEOUT_S
+        while len(self._statuses) < len(self.workers) and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.02)
+        statuses, self._statuses = self._statuses, None
+        merged = {"status": "QUEUE_STATUS", "depth": 0, "maxQueued": 0, "maxRunning": 0,
+                  "running": [], "queued": [], "sessions": [], "workers": []}
+        for index, status in sorted(statuses.items()):
+            for key in ("depth", "maxQueued", "maxRunning"):
+                merged[key] += status.get(key, 0)
+            merged["running"] += [{**job, "worker": index} for job in status.get("running", [])]
+            merged["queued"] += [{**job, "worker": index} for job in status.get("queued", [])]
+            merged["sessions"] += [{**session, "worker": index} for session in status.get("sessions", [])]
+            merged["workers"].append({
+                "worker": index,
+                "depth": status.get("depth", 0),
+                "running": len(status.get("running", [])),
+                "load": self.workers[index].load,
+            })
+        merged["queued"].sort(key=lambda job: job.get("eta_s", 0))
+        _print(merged)
+
+async def supervise(count=EQUIP_WORKERS):
+    """Supervisor main loop: read commands from stdin and route them to the workers."""
+    supervisor = Supervisor(count)
+    await supervisor.start()
+    loop = asyncio.get_running_loop()
+    while not supervisor.closing:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        try:
+            cmd = json.loads(line.strip())
+        except json.JSONDecodeError:
+            _print({"status": "FAILED", "error": "Invalid JSON"})
+            continue
+        await supervisor.handle(cmd)
+
+    if not supervisor.closing:
+        # Node closed our stdin: let the workers shut down with it
+        supervisor.closing = True
+        for worker in supervisor.workers:
+            worker.closing = True
+            worker.proc.stdin.close()
+        await asyncio.gather(*[w.proc.wait() for w in supervisor.workers])
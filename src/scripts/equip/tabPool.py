@@ -0,0 +1,193 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+from fillerRuntime import forget_filler
+from readiness import forget_readiness
+
+# Tabs each browser session may have open at once
+TAB_BUDGET = int(os.getenv("TAB_BUDGET", "12"))
+
+async def forget_tabs(tabs, unregister=True):
+    """Drop the per-tab readiness tracker and filler registration of `tabs`."""
+    for tab in tabs:
+        forget_readiness(tab)
+        await forget_filler(tab, unregister)
+
+class TabPool:
+    """
+    Pool of one browser's tabs (see pool_for).
+
+    Tabs are handed out to tasks through leases and returned to the idle list when a
+    task finishes a stage or stops, so later stages and later tasks reuse them instead
+    of reopening. No more than `budget` tabs are ever open at once (the browser's own
+    first tab, used for login, is not part of the pool).
+    """
+
+    def __init__(self, budget=TAB_BUDGET):
+        self.budget = max(1, budget)
+        self._idle = []
+        self._leased = []
+        self._cond = asyncio.Condition()
+
+    @property
+    def open_count(self):
+        return len(self._idle) + len(self._leased)
+
+    @property
+    def in_use(self):
+        """Tabs currently leased to tasks."""
+        return len(self._leased)
+
+    def lease(self, browser, task_id=None):
+        return TabLease(self, browser, task_id)
+
+    def _alive(self, browser, tab):
+        return not tab.closed and tab in browser.tabs
+
+    async def checkout(self, browser, count, minimum=1):
+        """Take up to `count` tabs, waiting until at least `minimum` are free under the budget."""
+        async with self._cond:
+            while True:
+                self._idle = [t for t in self._idle if self._alive(browser, t)]
+                free = len(self._idle) + (self.budget - self.open_count)
+                if free >= min(minimum, count):
+                    break
+                await self._cond.wait()
+
+            tabs = []
+            while self._idle and len(tabs) < count:
+                tabs.append(self._idle.pop())
+            while len(tabs) < count and self.open_count + len(tabs) < self.budget:
+                tabs.append(await browser.get("about:blank", new_tab=True))
+
+            self._leased.extend(tabs)
+            return tabs
+
+    async def checkin(self, tabs):
+        """Return tabs to the idle list; blanking them aborts whatever they were loading."""
+        await forget_tabs(tabs)
+        for tab in tabs:
+            try:
+                await tab.get("about:blank")
+            except Exception as e:
+                print(f"Warning: Failed to reset tab: {e}", file=sys.stderr)
+
+        async with self._cond:
+            for tab in tabs:
+                if tab in self._leased:
+                    self._leased.remove(tab)
+                if not tab.closed:
+                    self._idle.append(tab)
+            self._cond.notify_all()
+
+    async def discard(self, tab):
+        """Drop a leased tab that crashed or closed, freeing its place in the budget."""
+        async with self._cond:
+            if tab in self._leased:
+                self._leased.remove(tab)
+            self._cond.notify_all()
+        await forget_tabs([tab], unregister=False)
+        try:
+            if not tab.closed:
+                await tab.close()
+        except Exception as e:
+            print(f"Warning: Failed to close crashed tab: {e}", file=sys.stderr)
+
+    async def close_idle(self, keep=0):
+        """Close idle tabs beyond `keep`, e.g. when the worker goes quiet or shuts down."""
+        async with self._cond:
+            surplus, self._idle = self._idle[keep:], self._idle[:keep]
+        await forget_tabs(surplus, unregister=False)
+        for tab in surplus:
+            try:
+                await tab.close()
+            except Exception as e:
+                print(f"Warning: Failed to close tab: {e}", file=sys.stderr)
+
+    async def reset(self):
+        """Forget every tab, used when the browser itself is replaced."""
+        async with self._cond:
+            self._idle.clear()
+            self._leased.clear()
+            self._cond.notify_all()
+
+class TabLease:
+    """The tabs held by one task. `tabs[0]` is the task's main page."""
+
+    def __init__(self, pool, browser, task_id=None):
+        self.pool = pool
+        self.browser = browser
+        self.task_id = task_id
+        self.tabs = []
+
+    async def acquire(self, count, url=None):
+        """
+        Grow the lease to `count` tabs (fewer if the worker budget is exhausted; at
+        least one) and return them. Tabs already held are reused; if `url` is given
+        every returned tab is navigated to it.
+        """
+        missing = count - len(self.tabs)
+        if missing > 0:
+            self.tabs.extend(await self.pool.checkout(self.browser, missing, minimum=0 if self.tabs else 1))
+
+        tabs = self.tabs[:count]
+        if url:
+            await asyncio.gather(*[tab.get(url) for tab in tabs])
+        return tabs
+
+    async def main(self, url=None):
+        """The task's main page, optionally navigated to `url`."""
+        return (await self.acquire(1, url))[0]
+
+    async def replace(self, tab):
+        """Swap `tab` (crashed or closed) for a fresh tab in the same position of the lease."""
+        await self.pool.discard(tab)
+        fresh = (await self.pool.checkout(self.browser, 1))[0]
+        if tab in self.tabs:
+            self.tabs[self.tabs.index(tab)] = fresh
+        else:
+            self.tabs.append(fresh)
+        return fresh
+
+    async def abort(self):
+        """Blank every held tab so in-flight navigations and waits end; the tabs stay leased."""
+        for tab in self.tabs:
+            try:
+                await tab.get("about:blank")
+            except Exception as e:
+                print(f"Warning: Failed to abort tab: {e}", file=sys.stderr)
+
+    async def release(self, keep=0):
+        """Give back every tab past the first `keep`."""
+        surplus, self.tabs = self.tabs[keep:], self.tabs[:keep]
+        if surplus:
+            await self.pool.checkin(surplus)
+
+# One pool per browser, so each user's session (see browser.py) reuses only its own tabs
+_pools = {}
+
+def pool_for(browser):
+    """The tab pool of `browser`, created on first use."""
+    if browser not in _pools:
+        _pools[browser] = TabPool()
+    return _pools[browser]
+
+async def drop_pool(browser):
+    """Forget `browser`'s pool and its tabs, used when the browser is closed."""
+    pool = _pools.pop(browser, None)
+    if pool:
+        await pool.reset()
+
+@asynccontextmanager
+async def borrowed_lease(browser, lease=None):
+    """Use the caller's lease, or a temporary one released on exit."""
+    if lease is not None:
+        yield lease
+        return
+    temp = pool_for(browser).lease(browser)
+    try:
+        yield temp
+    finally:
+        await temp.release()
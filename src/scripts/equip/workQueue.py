@@ -0,0 +1,192 @@
+import asyncio
+import os
+import sys
+import time
+
+from retryPolicy import RetryPolicy, NETWORK, SESSION_EXPIRED, TARGET_CRASHED, SessionExpiredError
+from tracing import span, span_tags
+
+# Tab count control for queue stages: "0" keeps every stage at the requested tabs
+ADAPTIVE_TABS = os.getenv("ADAPTIVE_TABS", "1") != "0"
+AIMD_START_TABS = int(os.getenv("AIMD_START_TABS", "2"))
+AIMD_WINDOW = int(os.getenv("AIMD_WINDOW", "6"))
+AIMD_MAX_FAILURE_RATE = float(os.getenv("AIMD_MAX_FAILURE_RATE", "0.2"))
+AIMD_LATENCY_FACTOR = float(os.getenv("AIMD_LATENCY_FACTOR", "1.5"))
+
+class TabController:
+    """
+    Additive-increase/multiplicative-decrease control of how many tabs a stage uses.
+
+    Starts at `start` tabs and judges every window of finished items (at least `window`,
+    and at least one per tab): a failure rate above `max_failure_rate`, or a mean item
+    latency above `latency_factor` times the best window seen so far, halves the tab
+    count; otherwise one tab is added, never past `ceiling`. `on_change(old, new, stats)`
+    is called on every change.
+    """
+
+    def __init__(self, ceiling, start=AIMD_START_TABS, window=AIMD_WINDOW, max_failure_rate=AIMD_MAX_FAILURE_RATE,
+                 latency_factor=AIMD_LATENCY_FACTOR, on_change=None):
+        self.ceiling = max(1, ceiling)
+        self.tabs = min(max(1, start), self.ceiling)
+        self.window = max(1, window)
+        self.max_failure_rate = max_failure_rate
+        self.latency_factor = latency_factor
+        self.on_change = on_change
+        self.baseline = None
+        self.changed = asyncio.Event()
+        self._samples = []
+
+    def observe(self, latency, ok):
+        self._samples.append((latency, ok))
+        if len(self._samples) < max(self.window, self.tabs):
+            return
+
+        samples, self._samples = self._samples, []
+        failure_rate = sum(1 for _, ok in samples if not ok) / len(samples)
+        latencies = [latency for latency, ok in samples if ok]
+        mean = sum(latencies) / len(latencies) if latencies else None
+        slow = mean is not None and self.baseline is not None and mean > self.baseline * self.latency_factor
+        if mean is not None:
+            self.baseline = mean if self.baseline is None else min(self.baseline, mean)
+
+        if failure_rate > self.max_failure_rate or slow:
+            tabs = max(1, self.tabs // 2)
+            reason = "failures" if failure_rate > self.max_failure_rate else "latency"
+        else:
+            tabs = min(self.ceiling, self.tabs + 1)
+            reason = "healthy"
+
+        if tabs != self.tabs:
+            old, self.tabs = self.tabs, tabs
+            self.changed.set()
+            if self.on_change:
+                self.on_change(old, tabs, {
+                    "reason": reason,
+                    "failure_rate": round(failure_rate, 3),
+                    "latency_ms": round(mean * 1000) if mean is not None else None,
+                    "baseline_ms": round(self.baseline * 1000) if self.baseline is not None else None,
+                })
+
+class WorkQueue:
+    """
+    One shared queue of work items that every tab of a stage pulls from.
+
+    A tab takes the next item as soon as it is free, so a slow page or a retry holds up
+    only the tab it happens on. An item fails when its handler raises or returns a dict
+    with status FAILED; each failure is classified and retried within that class's
+    budget (see retryPolicy) after a jittered backoff:
+
+    - network failures go back to the end of the queue, for whichever tab is free next;
+    - validation and unknown failures are retried right away on the same tab;
+    - a crashed tab is swapped for a fresh one through `replace_page` first;
+    - once the session-expired budget is spent the stage stops with SessionExpiredError,
+      as no other item can succeed either.
+
+    A FAILED result with `"retryable": False` is not retried. Items out of retries are
+    listed in `failed` as (item, error). Every attempt is timed as span `label`, tagged
+    with the tab and with `tags(item)`.
+    """
+
+    def __init__(self, items, handler, control_state=None, replace_page=None, budgets=None,
+                 label="queue.item", tags=None):
+        self.handler = handler
+        self.label = label
+        self.tags = tags or (lambda item: {})
+        self.control_state = control_state
+        self.replace_page = replace_page
+        self.budgets = budgets
+        self.total = len(items)
+        self.done = 0
+        self.failed = []
+        self._queue = asyncio.Queue()
+        for item in items:
+            self._queue.put_nowait((item, RetryPolicy(budgets)))
+
+    async def _consume(self, page, slot=0, controller=None):
+        from worker_equip import check_control, TaskStoppedException
+
+        current = None
+        while True:
+            if current is None:
+                # Tabs past the controller's current count stop after their item
+                if controller and slot >= controller.tabs:
+                    return
+                try:
+                    current = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+            item, policy = current
+            if self.control_state:
+                await check_control(self.control_state)
+
+            start = time.perf_counter()
+            failure_class, retryable = None, True
+            try:
+                with span_tags(**self.tags(item)), span(self.label, page):
+                    result = await self.handler(page, item)
+                failed = isinstance(result, dict) and result.get("status") == "FAILED"
+                error = (result.get("error") or "failed") if failed else None
+                if failed:
+                    failure_class = result.get("failure")
+                    retryable = result.get("retryable", True)
+            except TaskStoppedException:
+                raise
+            except Exception as e:
+                error = e
+            if controller:
+                controller.observe(time.perf_counter() - start, error is None)
+
+            if error is None:
+                self.done += 1
+                current = None
+                continue
+
+            failure_class, delay = policy.failed(error, failure_class)
+            if delay is None or not retryable:
+                if failure_class == SESSION_EXPIRED:
+                    raise SessionExpiredError(str(error))
+                self.failed.append((item, f"{failure_class}: {error}"))
+                current = None
+                continue
+
+            print(f"[QUEUE] {failure_class} failure, retrying in {delay:.1f}s: {error}", file=sys.stderr)
+            await asyncio.sleep(delay)
+            if failure_class == TARGET_CRASHED and self.replace_page:
+                page = await self.replace_page(page)
+            if failure_class == NETWORK:
+                self._queue.put_nowait(current)
+                current = None
+
+    async def run(self, pages):
+        """Work through the queue with one consumer per page; returns the failed items."""
+        await asyncio.gather(*[self._consume(page) for page in pages])
+        return self.failed
+
+    async def run_adaptive(self, lease, controller):
+        """
+        Work through the queue on as many of `lease`'s tabs as `controller` allows at
+        each moment; tabs are added to the lease as the count grows. Returns the failed items.
+        """
+        consumers = {}
+        try:
+            while True:
+                pages = await lease.acquire(controller.tabs)
+                for slot, page in enumerate(pages):
+                    if (slot not in consumers or consumers[slot].done()) and not self._queue.empty():
+                        consumers[slot] = asyncio.create_task(self._consume(page, slot, controller))
+
+                live = [task for task in consumers.values() if not task.done()]
+                if not live:
+                    break
+                controller.changed.clear()
+                changed = asyncio.create_task(controller.changed.wait())
+                await asyncio.wait(live + [changed], return_when=asyncio.FIRST_COMPLETED)
+                changed.cancel()
+
+                for task in consumers.values():
+                    if task.done() and task.exception():
+                        raise task.exception()
+        finally:
+            for task in consumers.values():
+                task.cancel()
+        return self.failed
@@ -1,51 +1,133 @@
 import asyncio
+import os
 import sys
 import json
 import traceback
 import platform
 import uuid
 
+# Modules shared with the taqeem worker (readiness, filler runtime, element waits) live in src/scripts/shared
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shared"))
+
+from nodriver import cdp
+
 from login import startLogin, submitOtp
-from browser import closeBrowser, get_browser
+from browser import closeBrowser, close_all_browsers, get_browser, sessions, OTP_WAIT_S
 from formFiller import runFormFill
 from formFiller2 import runFormFill2, runCheckMacros, retryMacros
 from addAssets import add_assets_to_report, check_incomplete_macros
+from tabPool import pool_for
+from database import warm_up, close_client
+from progress import emit_progress, flush_progress
+from scheduler import JobScheduler
 
 if platform.system().lower() == "windows":
     sys.stdout.reconfigure(encoding="utf-8")
     sys.stderr.reconfigure(encoding="utf-8")
 
-_task_controls = {} 
+# How long a stop waits for the task's buffers to flush and the cancelled task to hand back its tabs
+STOP_GRACE_S = float(os.getenv("STOP_GRACE_S", "3"))
 
 class TaskStoppedException(Exception):
     """Raised when task is stopped"""
     pass
 
-def create_control_state(task_id, report_id=None):
-    """Create a new control state for a task"""
-    _task_controls[task_id] = {
-        "paused": False,
-        "stopped": False,
-        "report_id": report_id
-    }
-    return _task_controls[task_id]
+class TaskRegistry:
+    """
+    Control states of the running tasks, indexed by task id and by report id.
+
+    A state holds the task's lease and write buffers, a `running` event that is clear
+    while the task is paused, and the asyncio task itself so a stop can cancel it.
+    """
+
+    def __init__(self):
+        self._by_task = {}
+        self._by_report = {}
+
+    def create(self, task_id, report_id=None, lease=None):
+        running = asyncio.Event()
+        running.set()
+        state = {
+            "task_id": task_id,
+            "report_id": report_id,
+            "stopped": False,
+            "running": running,
+            "task": asyncio.current_task(),
+            "lease": lease,
+            "buffers": [],
+        }
+        self._by_task[task_id] = state
+        if report_id:
+            self._by_report[report_id] = task_id
+        return state
+
+    def get(self, task_id):
+        return self._by_task.get(task_id)
+
+    def find(self, task_id=None, report_id=None):
+        """The state for `task_id`, else for the latest task of `report_id`; None if neither runs."""
+        if task_id and task_id in self._by_task:
+            return self._by_task[task_id]
+        if report_id:
+            return self._by_task.get(self._by_report.get(report_id))
+        return None
+
+    def remove(self, task_id):
+        state = self._by_task.pop(task_id, None)
+        if state and self._by_report.get(state["report_id"]) == task_id:
+            del self._by_report[state["report_id"]]
+        return state
+
+_tasks = TaskRegistry()
+
+def create_control_state(task_id, report_id=None, lease=None):
+    """Create a new control state for a task running in the current asyncio task"""
+    return _tasks.create(task_id, report_id, lease)
 
 def get_control_state(task_id):
     """Get control state for a task"""
-    return _task_controls.get(task_id)
+    return _tasks.get(task_id)
 
-def cleanup_control_state(task_id):
-    """Remove control state when task completes"""
-    if task_id in _task_controls:
-        del _task_controls[task_id]
+async def cleanup_control_state(task_id):
+    """Remove control state when task completes and hand its tabs back to the pool"""
+    state = _tasks.remove(task_id)
+    if state and state.get("lease"):
+        if state["stopped"]:
+            # Blank the tabs so navigations the cancelled task started do not carry on
+            await state["lease"].abort()
+        await state["lease"].release()
 
 async def check_control(state):
-    """Check if we should pause or stop"""
+    """Raise if the task was stopped; wait while it is paused"""
     if state["stopped"]:
         raise TaskStoppedException("Task was stopped by user")
-    
-    while state["paused"]:
-        await asyncio.sleep(0.5)
+    if not state["running"].is_set():
+        await state["running"].wait()
+        if state["stopped"]:
+            raise TaskStoppedException("Task was stopped by user")
+
+def pause_task(state):
+    state["running"].clear()
+
+def resume_task(state):
+    state["running"].set()
+
+async def stop_task(state):
+    """
+    Stop a task at once: flush its write buffers, cancel its asyncio task (ending
+    whatever navigation or wait it is in) and give both up to STOP_GRACE_S, in which the
+    task releases its tabs as it unwinds.
+    """
+    state["stopped"] = True
+    state["running"].set()
+    task = state.get("task")
+    if task is None or task.done() or task is asyncio.current_task():
+        return
+    flushes = {asyncio.ensure_future(buffer.flush()) for buffer in list(state["buffers"])}
+    task.cancel()
+    done, _ = await asyncio.wait({task, *flushes}, timeout=STOP_GRACE_S)
+    if task not in done:
+        print(f"Task {state['task_id']} still unwinding after {STOP_GRACE_S}s", file=sys.stderr)
 
 async def _readline(loop):
     return await loop.run_in_executor(None, sys.stdin.readline)
@@ -68,240 +150,264 @@ async def command_handler():
         action = cmd.get("action")
         
         # Handle control commands (require taskId or reportId)
-        if action == "pause":
-            task_id = cmd.get("taskId")
-            report_id = cmd.get("reportId")
-            
-            # Find task by taskId or reportId
-            target_state = None
-            if task_id and task_id in _task_controls:
-                target_state = _task_controls[task_id]
-            elif report_id:
-                for tid, state in _task_controls.items():
-                    if state.get("report_id") == report_id:
-                        target_state = state
-                        task_id = tid
-                        break
-            
-            if target_state:
-                target_state["paused"] = True
-                print(json.dumps({
-                    "status": "PAUSED", 
-                    "message": "Task paused",
-                    "taskId": task_id,
-                    "reportId": report_id
-                }), flush=True)
-            else:
-                print(json.dumps({
-                    "status": "FAILED", 
-                    "error": "Task not found",
-                    "taskId": task_id,
-                    "reportId": report_id
-                }), flush=True)
-        
-        elif action == "resume":
-            task_id = cmd.get("taskId")
-            report_id = cmd.get("reportId")
-            
-            target_state = None
-            if task_id and task_id in _task_controls:
-                target_state = _task_controls[task_id]
-            elif report_id:
-                for tid, state in _task_controls.items():
-                    if state.get("report_id") == report_id:
-                        target_state = state
-                        task_id = tid
-                        break
-            
-            if target_state:
-                target_state["paused"] = False
-                print(json.dumps({
-                    "status": "RESUMED", 
-                    "message": "Task resumed",
-                    "taskId": task_id,
-                    "reportId": report_id
-                }), flush=True)
-            else:
-                print(json.dumps({
-                    "status": "FAILED", 
-                    "error": "Task not found",
-                    "taskId": task_id,
-                    "reportId": report_id
-                }), flush=True)
-
-        elif action == "stop":
-            task_id = cmd.get("taskId")
-            report_id = cmd.get("reportId")
-            
-            target_state = None
-            if task_id and task_id in _task_controls:
-                target_state = _task_controls[task_id]
-            elif report_id:
-                for tid, state in _task_controls.items():
-                    if state.get("report_id") == report_id:
-                        target_state = state
-                        task_id = tid
-                        break
-            
-            if target_state:
-                target_state["stopped"] = True
-                target_state["paused"] = False  # Unpause if paused
-                
-                # Close all tabs except the main page
-                try:
-                    browser = await get_browser()
-                    pages = browser.tabs
-                    if len(pages) > 1:
-                        # Close all tabs except the first one (main page)
-                        for page in pages[1:]:
-                            try:
-                                await page.close()
-                            except Exception as e:
-                                print(f"Warning: Failed to close tab: {e}", file=sys.stderr)
-                        print(f"Closed {len(pages) - 1} additional tabs", file=sys.stderr)
-                except Exception as e:
-                    print(f"Warning: Error closing tabs: {e}", file=sys.stderr)
-                
-                print(json.dumps({
-                    "status": "STOPPED", 
-                    "message": "Task stopped",
-                    "taskId": task_id,
-                    "reportId": report_id
-                }), flush=True)
-            else:
-                print(json.dumps({
-                    "status": "FAILED", 
-                    "error": "Task not found",
-                    "taskId": task_id,
-                    "reportId": report_id
-                }), flush=True)
+        if action in ("pause", "resume", "stop"):
+            await control_command(cmd)
         
+        elif action == "close" and cmd.get("userId"):
+            # One user left: close their browser, the worker keeps serving the others
+            closed = await closeBrowser(cmd["userId"])
+            print(json.dumps({"status": "CLOSED", "userId": cmd["userId"], "closed": closed}), flush=True)
+
         elif action == "close":
-            browser = await get_browser()
-            if browser is not None:
-                await closeBrowser()
-                await asyncio.sleep(1)
-                print(json.dumps({"status": "CLOSED"}), flush=True)
+            await close_all_browsers()
+            await asyncio.sleep(1)
+            print(json.dumps({"status": "CLOSED"}), flush=True)
 
             break
         
-        else:
-            # Queue other commands
+        elif action == "queueStatus":
+            print(json.dumps({**scheduler.status(), "sessions": sessions.status()}), flush=True)
+
+        elif action in ("login", "otp", "exportSession", "importSession"):
+            # The user's queued jobs need the session: never wait behind them
             asyncio.create_task(handle_action(cmd))
 
+        else:
+            schedule(cmd)
+
+def control_reply(status, message, task_id, report_id, **extra):
+    print(json.dumps({"status": status, "message": message, "taskId": task_id, "reportId": report_id, **extra}),
+          flush=True)
+
+async def control_command(cmd):
+    action = cmd.get("action")
+    task_id = cmd.get("taskId")
+    report_id = cmd.get("reportId")
+    state = _tasks.find(task_id, report_id)
+    if state:
+        task_id, report_id = state["task_id"], report_id or state["report_id"]
+
+    if action == "pause" and state:
+        pause_task(state)
+        control_reply("PAUSED", "Task paused", task_id, report_id)
+
+    elif action == "resume" and state:
+        resume_task(state)
+        control_reply("RESUMED", "Task resumed", task_id, report_id)
+
+    elif action == "resume" and report_id and scheduler.find(report_id, ("formFill2", "resumeFormFill2")):
+        # A run of this report is queued or starting: a second one would create its macros again
+        job = scheduler.find(report_id, ("formFill2", "resumeFormFill2"))
+        control_reply("ALREADY_QUEUED", "A run of this report is already queued", job.cmd["taskId"], report_id,
+                      jobId=job.id, action=job.action)
+
+    elif action == "resume" and report_id:
+        # Nothing running for this report (e.g. the worker restarted): continue from its checkpoint
+        control_reply("RESUMED", "Resuming from last checkpoint", task_id, report_id)
+        schedule({**cmd, "action": "resumeFormFill2"})
+
+    elif action == "stop" and scheduler.cancel(task_id, report_id):
+        control_reply("STOPPED", "Queued task removed before it started", task_id, report_id)
+
+    elif action == "stop" and state:
+        await stop_task(state)
+        control_reply("STOPPED", "Task stopped", task_id, report_id)
+
+    else:
+        print(json.dumps({"status": "FAILED", "error": "Task not found", "taskId": task_id, "reportId": report_id}),
+              flush=True)
+
+def schedule(cmd):
+    """Queue a job command, or tell Node the queue is full."""
+    job = scheduler.submit(cmd)
+    if job is None:
+        print(json.dumps({
+            "status": "QUEUE_FULL",
+            "error": f"Job queue is full ({scheduler.max_queued} waiting), try again later",
+            "action": cmd.get("action"),
+            "reportId": cmd.get("reportId"),
+            "taskId": cmd.get("taskId") or cmd.get("recordId"),
+        }), flush=True)
+        return
+    place = scheduler.place(job)
+    if place and job.report_id:
+        position, eta = place
+        emit_progress("QUEUED", f"Waiting for a free slot (position {position})", job.report_id,
+                      position=position, eta_s=eta, jobId=job.id)
+
+async def run_controlled(task_id, report_id, browser, run):
+    """
+    Run `run(control_state)` as a pausable, stoppable task and print its result. A stop
+    (TaskStoppedException or cancellation by `stop_task`) is reported as STOPPED.
+    """
+    control_state = create_control_state(task_id, report_id, pool_for(browser).lease(browser, task_id))
+    print(json.dumps({"status": "STARTED", "taskId": task_id, "reportId": report_id}), flush=True)
+    try:
+        result = await run(control_state)
+        result["taskId"] = task_id
+        print(json.dumps(result), flush=True)
+    except (TaskStoppedException, asyncio.CancelledError) as e:
+        if not control_state["stopped"]:
+            raise
+        current = asyncio.current_task()
+        if isinstance(e, asyncio.CancelledError) and hasattr(current, "uncancel"):
+            current.uncancel()
+        flush_progress()
+        print(json.dumps({
+            "status": "STOPPED", 
+            "message": str(e) or "Task was stopped by user",
+            "taskId": task_id,
+            "reportId": report_id
+        }), flush=True)
+    finally:
+        await cleanup_control_state(task_id)
+
+async def import_cookies(browser, cookies):
+    """
+    Set exported cookies (network.Cookie JSON) in `browser` and read the jar back.
+    Returns (cookies sent, cookies of those now in the jar).
+    """
+    params = []
+    for cookie in cookies:
+        param = cdp.network.CookieParam.from_json(cookie)
+        if cookie.get("session"):
+            # Session cookies are exported with expires -1, which would set them already expired
+            param.expires = None
+        params.append(param)
+    # CookieJar.set_all ignores its argument and re-sets the browser's own cookies
+    await browser.connection.send(cdp.storage.set_cookies(cookies=params))
+
+    jar = {(c.name, c.domain, c.path) for c in await browser.connection.send(cdp.storage.get_cookies())}
+    return len(params), sum(1 for p in params if (p.name, p.domain, p.path) in jar)
+
 async def handle_action(cmd):
-    record_id = cmd.get("recordId")
-    task_id = record_id
+    # The scheduler gives every job a task id; formFill2 commands carry no recordId
+    task_id = cmd.get("taskId") or cmd.get("recordId") or uuid.uuid4().hex
+    user_id = cmd.get("userId")
     
-    try:
-        action = cmd.get("action")
+    # Held for the whole command, so the session cannot be evicted under it
+    async with sessions.hold(user_id):
+        try:
+            action = cmd.get("action")
         
-        if action == "login":
-            browser = await get_browser(force_new=True)
-            page = await browser.get(
-                "https://sso.taqeem.gov.sa/realms/REL_TAQEEM/protocol/openid-connect/auth"
-                "?client_id=cli-qima-valuers&redirect_uri=https%3A%2F%2Fqima.taqeem.sa%2Fkeycloak%2Flogin%2Fcallback"
-                "&scope=openid&response_type=code"
-            )
-            result = await startLogin(page, cmd.get("email", ""), cmd.get("password", ""))
-            print(json.dumps(result), flush=True)
+            if action == "login":
+                # Restarts only this user's browser; other users' sessions keep running
+                browser = await get_browser(force_new=True, user_id=user_id)
+                page = await browser.get(
+                    "https://sso.taqeem.gov.sa/realms/REL_TAQEEM/protocol/openid-connect/auth"
+                    "?client_id=cli-qima-valuers&redirect_uri=https%3A%2F%2Fqima.taqeem.sa%2Fkeycloak%2Flogin%2Fcallback"
+                    "&scope=openid&response_type=code"
+                )
+                result = await startLogin(page, cmd.get("email", ""), cmd.get("password", ""))
+                # Waiting for the OTP command holds nothing: keep the session until it comes
+                sessions.pin(user_id, OTP_WAIT_S if result.get("status") == "OTP_REQUIRED" else 0)
+                print(json.dumps({**result, "userId": user_id}), flush=True)
         
-        elif action == "otp":
-            browser = await get_browser()
-            page = browser.main_tab
-            result = await submitOtp(page, cmd.get("otp", ""))
-            print(json.dumps(result), flush=True)
+            elif action == "otp":
+                browser = await get_browser(user_id=user_id)
+                page = browser.main_tab
+                result = await submitOtp(page, cmd.get("otp", ""), user_id=user_id)
+                if result.get("status") != "OTP_FAILED":
+                    sessions.pin(user_id, 0)
+                print(json.dumps({**result, "userId": user_id}), flush=True)
+        
+            elif action == "exportSession":
+                # Cookies of the user's logged-in browser, for the supervisor to copy to the other workers
+                browser = await get_browser(user_id=user_id)
+                cookies = await browser.cookies.get_all()
+                print(json.dumps({"status": "SESSION", "cookies": [c.to_json() for c in cookies], "taskId": task_id,
+                                  "userId": user_id}), flush=True)
+
+            elif action == "importSession":
+                browser = await get_browser(user_id=user_id)
+                reply = {"taskId": task_id, "userId": user_id, "attempt": cmd.get("attempt", 1)}
+                try:
+                    expected, count = await import_cookies(browser, cmd.get("cookies", []))
+                except Exception as e:
+                    print(json.dumps({"status": "SESSION_IMPORT_FAILED", "error": str(e), **reply}), flush=True)
+                    return
+                if count != expected:
+                    print(json.dumps({
+                        "status": "SESSION_IMPORT_FAILED",
+                        "error": f"{count} of {expected} cookies present after import",
+                        **reply,
+                    }), flush=True)
+                else:
+                    print(json.dumps({"status": "SESSION_IMPORTED", "count": count, **reply}), flush=True)
+
+            elif action in ("formFill2", "resumeFormFill2"):
+                browser = await get_browser(user_id=user_id)
+                tabs_num = int(cmd.get("tabsNum", 3))
+                report_id = cmd.get("reportId", "")
+                await run_controlled(task_id, report_id, browser, lambda control_state: runFormFill2(
+                    browser, report_id, tabs_num, control_state=control_state, lease=control_state["lease"],
+                    resume=action == "resumeFormFill2",
+                ))
         
-        elif action == "formFill2":
-            browser = await get_browser()
-            tabs_num = int(cmd.get("tabsNum", 3))
-            report_id = cmd.get("reportId", "")
-            
-            # Create control state for this specific task
-            control_state = create_control_state(task_id, report_id)
-            
-            try:
-                result = await runFormFill2(browser, report_id, tabs_num, control_state=control_state)
+            elif action == "checkMacros":
+                browser = await get_browser(user_id=user_id)
+                tabs_num = int(cmd.get("tabsNum", 3))
+                result = await runCheckMacros(browser, cmd.get("reportId", ""), tabs_num=tabs_num)
                 result["taskId"] = task_id
                 print(json.dumps(result), flush=True)
-            except TaskStoppedException as e:
-                print(json.dumps({
-                    "status": "STOPPED", 
-                    "message": str(e),
-                    "taskId": task_id,
-                    "reportId": report_id
-                }), flush=True)
-            finally:
-                cleanup_control_state(task_id)
         
-        elif action == "checkMacros":
-            browser = await get_browser()
-            tabs_num = int(cmd.get("tabsNum", 3))
-            result = await runCheckMacros(browser, cmd.get("reportId", ""), tabs_num=tabs_num)
-            result["taskId"] = task_id
-            print(json.dumps(result), flush=True)
+            elif action == "retryMacros":
+                browser = await get_browser(user_id=user_id)
+                tabs_num = int(cmd.get("tabsNum", 3))
+                report_id = cmd.get("recordId", "")
+                await run_controlled(task_id, report_id, browser, lambda control_state: retryMacros(
+                    browser, report_id, tabs_num=tabs_num, control_state=control_state, lease=control_state["lease"],
+                ))
         
-        elif action == "retryMacros":
-            browser = await get_browser()
-            tabs_num = int(cmd.get("tabsNum", 3))
-            report_id = cmd.get("recordId", "")
-            
-            # Create control state for retry task
-            control_state = create_control_state(task_id, report_id)
-            
-            try:
-                result = await retryMacros(browser, report_id, tabs_num=tabs_num, control_state=control_state)
+            elif action == "addAssets":
+                browser = await get_browser(user_id=user_id)
+                result = await add_assets_to_report(browser, cmd.get("reportId", ""))
                 result["taskId"] = task_id
                 print(json.dumps(result), flush=True)
-            except TaskStoppedException as e:
-                print(json.dumps({
-                    "status": "STOPPED", 
-                    "message": str(e),
-                    "taskId": task_id,
-                    "reportId": report_id
-                }), flush=True)
-            finally:
-                cleanup_control_state(task_id)
-        
-        elif action == "addAssets":
-            browser = await get_browser()
-            result = await add_assets_to_report(browser, cmd.get("reportId", ""))
-            result["taskId"] = task_id
-            print(json.dumps(result), flush=True)
         
-        elif action == "check":
-            browser = await get_browser()
-            result = await check_incomplete_macros(browser, cmd.get("reportId", ""))
-            result["taskId"] = task_id
-            print(json.dumps(result), flush=True)
+            elif action == "check":
+                browser = await get_browser(user_id=user_id)
+                result = await check_incomplete_macros(browser, cmd.get("reportId", ""))
+                result["taskId"] = task_id
+                print(json.dumps(result), flush=True)
         
-        elif action == "formFill":
-            browser = await get_browser()
-            result = await runFormFill(browser, cmd.get("reportId", ""))
-            result["taskId"] = task_id
-            print(json.dumps(result), flush=True)
+            elif action == "formFill":
+                browser = await get_browser(user_id=user_id)
+                result = await runFormFill(browser, cmd.get("reportId", ""))
+                result["taskId"] = task_id
+                print(json.dumps(result), flush=True)
         
-        else:
-            result = {"status": "FAILED", "error": f"Unknown action: {action}", "taskId": task_id}
-            print(json.dumps(result), flush=True)
+            else:
+                result = {"status": "FAILED", "error": f"Unknown action: {action}", "taskId": task_id}
+                print(json.dumps(result), flush=True)
     
-    except Exception as e:
-        tb = traceback.format_exc()
-        print(json.dumps({
-            "status": "FAILED", 
-            "error": str(e), 
-            "traceback": tb,
-            "taskId": task_id
-        }), flush=True)
-        cleanup_control_state(task_id)
+        except Exception as e:
+            tb = traceback.format_exc()
+            print(json.dumps({
+                "status": "FAILED", 
+                "error": str(e), 
+                "traceback": tb,
+                "taskId": task_id
+            }), flush=True)
+            await cleanup_control_state(task_id)
+
+scheduler = JobScheduler(handle_action)
 
 async def worker():
+    warm_up()
     try:
         await command_handler()
     except Exception as e:
         print(json.dumps({"status": "FATAL", "error": str(e)}), flush=True)
     finally:
-        await closeBrowser()
+        flush_progress()
+        await close_all_browsers()
+        close_client()
 
 if __name__ == "__main__":
-    asyncio.run(worker())
\ No newline at end of file
+    from supervisor import EQUIP_WORKERS, supervise
+
+    if EQUIP_WORKERS > 1:
+        asyncio.run(supervise(EQUIP_WORKERS))
+    else:
+        asyncio.run(worker())
\ No newline at end of file
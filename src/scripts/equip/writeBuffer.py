@@ -0,0 +1,148 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+from pymongo import UpdateOne
+
+BULK_MAX_FIELDS = int(os.getenv("BULK_MAX_FIELDS", "200"))
+BULK_FLUSH_S = float(os.getenv("BULK_FLUSH_S", "2"))
+
+class AssetWriteBuffer:
+    """
+    Write-behind buffer for the per-asset fields of one halfreport.
+
+    Writes are addressed as `asset_data.<index>.<field>`, with the index looked up in a
+    macro_id -> index map instead of a positional `asset_data.id` filter, so Mongo never
+    scans the embedded array. Pending fields are coalesced (the latest value wins) and
+    written with one bulk_write once `max_fields` are pending, `max_delay` seconds after
+    the first pending write, or on `flush`/`close`.
+    """
+
+    def __init__(self, collection, record_id, assets=(), max_fields=BULK_MAX_FIELDS, max_delay=BULK_FLUSH_S):
+        self.collection = collection
+        self.record_id = record_id
+        self.max_fields = max(1, max_fields)
+        self.max_delay = max_delay
+        self.index = {}
+        self.map_assets(assets)
+        self.flushes = 0
+        self.written = 0
+        self._pending = {}
+        self._lock = asyncio.Lock()
+        self._timer = None
+
+    def map_assets(self, assets):
+        for idx, asset in enumerate(assets):
+            macro_id = asset.get("id")
+            if macro_id in (None, ""):
+                continue
+            try:
+                self.index[int(macro_id)] = idx
+            except (TypeError, ValueError):
+                continue
+
+    def index_of(self, macro_id):
+        try:
+            return self.index.get(int(macro_id))
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _stage(self, idx, fields):
+        for name, value in fields.items():
+            self._pending[f"asset_data.{idx}.{name}"] = value
+        if "id" in fields:
+            self.index[int(fields["id"])] = idx
+
+    async def set(self, idx, **fields):
+        """Queue `$set` of `fields` on asset `idx`; setting `id` also maps it to `idx`."""
+        self._stage(idx, fields)
+        if len(self._pending) >= self.max_fields:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later(self.max_delay))
+
+    async def set_many(self, updates):
+        """Stage `(idx, fields)` pairs and write them together in a single bulk_write."""
+        for idx, fields in updates:
+            self._stage(idx, fields)
+        await self.flush()
+
+    def queue(self, idx, **fields):
+        """`set` for synchronous callers; a full buffer is flushed from a background task."""
+        self._stage(idx, fields)
+        if len(self._pending) >= self.max_fields:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = asyncio.create_task(self._flush_later(0))
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later(self.max_delay))
+
+    async def set_for_macro(self, macro_id, **fields):
+        """Queue `fields` for the asset holding `macro_id`. Returns False if it is not mapped."""
+        idx = self.index_of(macro_id)
+        if idx is None:
+            return False
+        await self.set(idx, **fields)
+        return True
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Write everything pending. On failure the fields stay queued for the next flush."""
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            items = list(pending.items())
+            ops = [
+                UpdateOne({"_id": self.record_id}, {"$set": dict(items[i:i + self.max_fields])})
+                for i in range(0, len(items), self.max_fields)
+            ]
+            written = False
+            try:
+                await self.collection.bulk_write(ops, ordered=True)
+                written = True
+                self.flushes += 1
+                self.written += len(items)
+            except Exception as e:
+                print(f"[DB BUFFER ERROR] {len(items)} fields not written: {e}", file=sys.stderr)
+            finally:
+                # Also when the task is cancelled mid-write: `close` writes them again
+                if not written:
+                    for name, value in pending.items():
+                        self._pending.setdefault(name, value)
+
+    async def close(self):
+        await self.flush()
+        if self._pending:
+            print(f"[DB BUFFER ERROR] dropping {len(self._pending)} unwritten fields for record {self.record_id}",
+                  file=sys.stderr)
+            self._pending.clear()
+
+@asynccontextmanager
+async def asset_writes(collection, record, control_state=None, **kwargs):
+    """
+    Buffer per-asset writes for `record` for the duration of a stage. The buffer is
+    listed in the task's control state so `stop_task` flushes it right away, and it is
+    flushed again when the stage exits, normally or not.
+    """
+    buffer = AssetWriteBuffer(collection, record["_id"], record.get("asset_data", []), **kwargs)
+    buffers = control_state.setdefault("buffers", []) if control_state is not None else []
+    buffers.append(buffer)
+    try:
+        yield buffer
+    finally:
+        buffers.remove(buffer)
+        await buffer.close()
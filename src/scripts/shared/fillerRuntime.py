@@ -0,0 +1,227 @@
+import asyncio
+import json
+import os
+import re
+import sys
+
+from nodriver import cdp
+
+from waits import wait_for_element
+
+# Seconds fill_late waits for fields the first pass found missing to appear
+FILL_LATE_TIMEOUT_S = float(os.getenv("FILL_LATE_TIMEOUT_S", "3"))
+
+# Installed into every document of a tab, so each fill only ships its data.
+# window.__fill(data) sets {selector: {type, value}} in order and reports per selector:
+# "ok", "missing" (no element), "no_option" (select fell back to its first option, or
+# a dynamic select matched nothing and was left as is), "approx" (dynamic select matched
+# by substring only) or "no_label" (no radio label with that text).
+_RUNTIME_JS = r"""
+(() => {
+    const fire = (el, ...types) => types.forEach(t => el.dispatchEvent(new Event(t, { bubbles: true })));
+
+    const norm = (text) => String(text ?? "").normalize("NFKC")
+        .replace(/[\u0610-\u061a\u064b-\u065f\u0670\u0640]/g, "")
+        .replace(/[أإآٱ]/g, "ا").replace(/ى/g, "ي").replace(/ة/g, "ه")
+        .replace(/\s+/g, " ").trim().toLowerCase();
+
+    // Option index per select, rebuilt when its options change
+    const indexes = new WeakMap();
+    const optionIndex = (el) => {
+        const opts = el.options;
+        const signature = opts.length + "|" + (opts[0]?.value ?? "") + "|" + (opts[opts.length - 1]?.value ?? "");
+        let index = indexes.get(el);
+        if (!index || index.signature !== signature) {
+            index = { signature, exact: new Map(), normalized: new Map(), all: [] };
+            for (const opt of opts) {
+                const text = opt.text.trim(), key = norm(text);
+                if (!index.exact.has(text)) index.exact.set(text, opt.value);
+                if (!index.normalized.has(key)) index.normalized.set(key, opt.value);
+                index.all.push([key, opt.value]);
+            }
+            indexes.set(el, index);
+        }
+        return index;
+    };
+
+    // Exact text, then normalized text, then the first option containing the value
+    const matchOption = (el, value) => {
+        const index = optionIndex(el);
+        const text = String(value ?? "").trim();
+        if (index.exact.has(text)) return [index.exact.get(text), "ok"];
+        const key = norm(text);
+        if (!key) return [null, "no_option"];
+        if (index.normalized.has(key)) return [index.normalized.get(key), "ok"];
+        const hit = index.all.find(([optionKey]) => optionKey.includes(key));
+        return hit ? [hit[1], "approx"] : [null, "no_option"];
+    };
+
+    const setters = {
+        checkbox(el, value) {
+            el.checked = Boolean(value);
+            fire(el, "change");
+            return "ok";
+        },
+        select(el, value) {
+            let found = false;
+            for (const opt of el.options) {
+                if (opt.value == value || opt.text == value) {
+                    el.value = opt.value;
+                    found = true;
+                    break;
+                }
+            }
+            if (!found && el.options.length) el.selectedIndex = 0;
+            fire(el, "change");
+            return found ? "ok" : "no_option";
+        },
+        dynamic_select(el, value) {
+            const [match, outcome] = matchOption(el, value);
+            if (match !== null) {
+                el.value = match;
+                fire(el, "change");
+            }
+            return outcome;
+        },
+        radio(el, value) {
+            for (const lbl of document.querySelectorAll("label.form-check-label")) {
+                if ((lbl.innerText || "").trim() === value) {
+                    const radio = document.getElementById(lbl.getAttribute("for"));
+                    if (radio) {
+                        radio.checked = true;
+                        fire(radio, "change");
+                        return "ok";
+                    }
+                }
+            }
+            return "no_label";
+        },
+        text(el, value) {
+            el.value = value ?? "";
+            fire(el, "input", "change");
+            return "ok";
+        },
+    };
+
+    window.__fill = (data) => {
+        const report = {};
+        for (const [selector, meta] of Object.entries(data)) {
+            const el = document.querySelector(selector);
+            if (!el) { report[selector] = "missing"; continue; }
+            const set = setters[meta.type] || setters.text;
+            try {
+                report[selector] = set(el, meta.value);
+            } catch (err) {
+                report[selector] = "error: " + err;
+            }
+        }
+        return JSON.stringify(report);
+    };
+})();
+"""
+
+# {target id: script identifier}. Keyed by target id: nodriver tabs define __eq__ without __hash__.
+_installed = {}
+
+async def install_filler(page):
+    """Register the filler runtime for every future document of the tab and load it into the current one."""
+    if page.target_id not in _installed:
+        _installed[page.target_id] = await page.send(
+            cdp.page.add_script_to_evaluate_on_new_document(source=_RUNTIME_JS)
+        )
+    await page.evaluate(_RUNTIME_JS)
+
+async def forget_filler(page, unregister=True):
+    """
+    Drop the tab's runtime registration, used when a lease releases the tab or it closes.
+    `unregister=False` skips the CDP call for a tab that is being closed anyway.
+    """
+    identifier = _installed.pop(page.target_id, None)
+    if identifier is None or not unregister or page.closed:
+        return
+    try:
+        await page.send(cdp.page.remove_script_to_evaluate_on_new_document(identifier=identifier))
+    except Exception as e:
+        print(f"Warning: Failed to unregister filler runtime: {e}", file=sys.stderr)
+
+async def fill_fields(page, data):
+    """
+    Set `data` ({selector: {"type", "value"}}) on the current document with one call of
+    the preinstalled runtime. Returns the per-selector report; if the call itself fails
+    every selector is reported as an error.
+    """
+    if not data:
+        return {}
+    payload = json.dumps(data, ensure_ascii=False)
+    call = f"window.__fill ? window.__fill({payload}) : null"
+
+    if page.target_id not in _installed:
+        await install_filler(page)
+    raw = await page.evaluate(call, return_by_value=True)
+    if not isinstance(raw, str):
+        # null (a RemoteObject): document created before the runtime was registered
+        await install_filler(page)
+        raw = await page.evaluate(call, return_by_value=True)
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        # A JS exception (ExceptionDetails) or a runtime that never loaded: nothing was set
+        error = f"error: {_describe(raw)}"
+        return {selector: error for selector in data}
+
+def _describe(raw):
+    """Readable text of a failed evaluate result."""
+    exception = getattr(raw, "exception", None)
+    return getattr(exception, "description", None) or getattr(raw, "text", None) or repr(raw)[:200]
+
+async def present_selectors(page, selectors):
+    """The subset of `selectors` that match in the current document, checked in one evaluate."""
+    selectors = list(selectors)
+    if not selectors:
+        return set()
+    found = await page.evaluate(f"""
+        JSON.stringify({json.dumps(selectors)}.filter(selector => {{
+            try {{ return document.querySelector(selector) !== null; }} catch (err) {{ return false; }}
+        }}))
+    """, return_by_value=True)
+    try:
+        return set(json.loads(found))
+    except (TypeError, ValueError):
+        return set()
+
+# {form variant (path with ids masked): selectors that never appeared on it}. Later
+# fills of the variant only check once for these instead of waiting for them.
+_absent = {}
+
+async def _form_variant(page):
+    path = await page.evaluate("location.pathname", return_by_value=True)
+    return re.sub(r"\d+", ":id", path) if isinstance(path, str) else None
+
+async def fill_late(page, data, report, timeout=None):
+    """
+    Set again the fields of `data` the first pass reported missing, once their elements
+    appear (waiting up to `timeout`, by default FILL_LATE_TIMEOUT_S, seconds for all of
+    them together). Selectors this form variant has never shown are not waited for.
+    Updates and returns `report`.
+    """
+    pending = [selector for selector in data if report.get(selector) == "missing"]
+    if not pending:
+        return report
+    timeout = FILL_LATE_TIMEOUT_S if timeout is None else timeout
+    variant = await _form_variant(page)
+    absent = _absent.setdefault(variant, set()) if variant else set()
+
+    waited = [selector for selector in pending if selector not in absent]
+    found = await asyncio.gather(*[wait_for_element(page, selector, timeout=timeout) for selector in waited])
+    present = {selector for selector, element in zip(waited, found) if element}
+    present |= await present_selectors(page, [selector for selector in pending if selector in absent])
+    absent.difference_update(present)
+    absent.update(selector for selector in waited if selector not in present)
+
+    late = {selector: data[selector] for selector in pending if selector in present}
+    report.update(await fill_fields(page, late))
+    return report
+
+def unfilled(report):
+    """Selectors the runtime could not set exactly: missing, approximate or unmatched."""
+    return {selector: outcome for selector, outcome in report.items() if outcome != "ok"}
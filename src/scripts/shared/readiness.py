@@ -0,0 +1,284 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+
+from nodriver import cdp
+
+from tracing import span
+
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "15"))
+NETWORK_IDLE_MS = int(os.getenv("NETWORK_IDLE_MS", "250"))
+ERROR_SELECTOR = "div.alert.alert-danger"
+
+# Per-task tally of how long readiness waits took versus the fixed sleeps they replaced.
+# Set by a top-level flow; gathered sub-tasks inherit the same dict through the context.
+ready_stats = contextvars.ContextVar("ready_stats", default=None)
+
+def start_ready_stats():
+    stats = {"waits": 0, "waited_s": 0.0, "replaced_s": 0.0, "fallbacks": 0}
+    ready_stats.set(stats)
+    return stats
+
+def summarize_ready_stats(stats, macros):
+    """Seconds saved overall and per macro compared with the old fixed sleeps."""
+    saved = stats["replaced_s"] - stats["waited_s"]
+    return {
+        "waits": stats["waits"],
+        "fallbacks": stats["fallbacks"],
+        "saved_s": round(saved, 2),
+        "saved_per_macro_s": round(saved / macros, 3) if macros else 0.0,
+    }
+
+def _record(elapsed, replaces, ok):
+    stats = ready_stats.get()
+    if stats is None:
+        return
+    stats["waits"] += 1
+    stats["waited_s"] += elapsed
+    stats["replaced_s"] += replaces
+    if not ok:
+        stats["fallbacks"] += 1
+
+class PageReadiness:
+    """
+    Follows one tab's page loads and in-flight requests through CDP events
+    (Page.loadEventFired, Page.frameNavigated, Network.requestWillBeSent/loadingFinished/
+    loadingFailed), so callers can wait for "loaded and network idle" instead of sleeping.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.loads = 0
+        self.inflight = set()
+        self.last_activity = time.monotonic()
+        self._changed = asyncio.Event()
+
+    def _handlers(self):
+        return [
+            (cdp.page.LoadEventFired, self._on_load),
+            (cdp.page.FrameNavigated, self._on_navigated),
+            (cdp.network.RequestWillBeSent, self._on_request),
+            (cdp.network.LoadingFinished, self._on_request_done),
+            (cdp.network.LoadingFailed, self._on_request_done),
+        ]
+
+    async def install(self):
+        for event, handler in self._handlers():
+            self.page.add_handler(event, handler)
+        await self.page.send(cdp.page.enable())
+        await self.page.send(cdp.network.enable())
+
+    def uninstall(self):
+        # Only this tracker's handlers: Connection.remove_handler drops every handler of the event
+        for event, handler in self._handlers():
+            handlers = self.page.handlers.get(event, [])
+            if handler in handlers:
+                handlers.remove(handler)
+
+    def _touch(self):
+        self.last_activity = time.monotonic()
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def _on_load(self, event, connection=None):
+        self.loads += 1
+        self._touch()
+
+    def _on_navigated(self, event, connection=None):
+        if event.frame.parent_id is None:
+            self.inflight.clear()
+            self._touch()
+
+    def _on_request(self, event, connection=None):
+        self.inflight.add(event.request_id)
+        self._touch()
+
+    def _on_request_done(self, event, connection=None):
+        self.inflight.discard(event.request_id)
+        self._touch()
+
+    def mark(self):
+        """Load counter to pass to `wait_ready` after triggering a navigation."""
+        return self.loads
+
+    def _idle_for(self):
+        if self.inflight:
+            return 0.0
+        return time.monotonic() - self.last_activity
+
+    async def _wait_change(self, timeout):
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def wait_idle(self, timeout=READY_TIMEOUT, idle_ms=NETWORK_IDLE_MS):
+        """Wait until no request has been in flight for `idle_ms`. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        idle_s = idle_ms / 1000
+        while True:
+            idle_for = self._idle_for()
+            if idle_for >= idle_s:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await self._wait_change(min(remaining, idle_s - idle_for))
+
+    async def wait_ready(self, since, timeout=READY_TIMEOUT, idle_ms=NETWORK_IDLE_MS):
+        """
+        Wait for a load event after `since` (see `mark`) followed by network idle.
+        Returns True once loaded, even if a long-polling request keeps the network busy
+        until the deadline; returns False if no load happened in time.
+        """
+        deadline = time.monotonic() + timeout
+        if not await self.wait_load(since, timeout):
+            return False
+        await self.wait_idle(max(0.0, deadline - time.monotonic()), idle_ms)
+        return True
+
+    async def wait_load(self, since, timeout=READY_TIMEOUT):
+        """Wait for a load event after `since`. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self.loads <= since:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await self._wait_change(remaining)
+        return True
+
+# Keyed by target id: nodriver tabs define __eq__ without __hash__.
+_trackers = {}
+
+async def readiness_for(page):
+    """The tab's PageReadiness, installed on first use."""
+    tracker = _trackers.get(page.target_id)
+    if tracker is None:
+        tracker = PageReadiness(page)
+        await tracker.install()
+        _trackers[page.target_id] = tracker
+    return tracker
+
+def forget_readiness(page):
+    """Stop tracking `page` and drop its tracker, used when a lease releases the tab or it closes."""
+    tracker = _trackers.pop(page.target_id, None)
+    if tracker is not None:
+        tracker.uninstall()
+
+async def navigate(page, url, timeout=READY_TIMEOUT, replaces=0.0):
+    """`page.get(url)` that returns once the new document has loaded and the network is idle."""
+    start = time.monotonic()
+    with span("navigate", page):
+        tracker = await readiness_for(page)
+        since = tracker.mark()
+        await page.get(url)
+        ok = await tracker.wait_ready(since, timeout)
+    _record(time.monotonic() - start, replaces, ok)
+    return ok
+
+async def settle(page, timeout=READY_TIMEOUT, replaces=0.0):
+    """Wait for in-flight requests on the current document (e.g. dependent selects) to finish."""
+    start = time.monotonic()
+    with span("settle", page):
+        tracker = await readiness_for(page)
+        ok = await tracker.wait_idle(timeout)
+    _record(time.monotonic() - start, replaces, ok)
+    return ok
+
+async def click_and_wait(page, element, timeout=READY_TIMEOUT, replaces=0.0):
+    """Click an element that submits or navigates, then wait for the resulting load.
+    Returns False if no navigation happened within `timeout`."""
+    start = time.monotonic()
+    with span("click_and_wait", page):
+        tracker = await readiness_for(page)
+        since = tracker.mark()
+        await element.click()
+        ok = await tracker.wait_ready(since, timeout)
+    _record(time.monotonic() - start, replaces, ok)
+    return ok
+
+# Arms window.__errorWatch: resolves with the text of the first error element that
+# appears after arming (ones already on the page are ignored), or null after the timeout.
+_ERROR_WATCH_JS = """
+(() => {
+    const selector = %s;
+    document.querySelectorAll(selector).forEach(el => { el.__seenError = true; });
+    window.__errorWatch = new Promise(resolve => {
+        const fresh = () => [...document.querySelectorAll(selector)].find(el => !el.__seenError);
+        const done = (value) => { observer.disconnect(); clearTimeout(timer); resolve(value); };
+        const observer = new MutationObserver(() => {
+            const el = fresh();
+            if (el) done((el.innerText || el.textContent || "").trim() || "error");
+        });
+        observer.observe(document.documentElement, { childList: true, subtree: true, attributes: true });
+        const timer = setTimeout(() => done(null), %d);
+    });
+})()
+"""
+
+_ERROR_TEXT_JS = """
+(() => {
+    const el = document.querySelector(%s);
+    return el ? ((el.innerText || el.textContent || "").trim() || "error") : null;
+})()
+"""
+
+async def click_outcome(page, element, timeout=READY_TIMEOUT, error_selector=ERROR_SELECTOR, replaces=0.0):
+    """
+    Click a submit or continue button and report what came of it as soon as it is known,
+    racing a page load (then network idle) against an error element appearing in place:
+
+    - {"outcome": "navigated", "url"}: a new document loaded without an error element;
+    - {"outcome": "validation_error", "url", "error"}: the form came back with errors,
+      either in place or as the newly loaded page;
+    - {"outcome": "timeout", "url"}: neither happened within `timeout`.
+
+    Each also carries `elapsed_s`.
+    """
+    start = time.monotonic()
+    with span("click_outcome", page):
+        outcome = await _race_click(page, element, timeout, error_selector)
+    _record(time.monotonic() - start, replaces, outcome["outcome"] != "timeout")
+    outcome["elapsed_s"] = round(time.monotonic() - start, 3)
+    return outcome
+
+async def _race_click(page, element, timeout, error_selector):
+    tracker = await readiness_for(page)
+    deadline = time.monotonic() + timeout
+    await page.evaluate(_ERROR_WATCH_JS % (json.dumps(error_selector), int(timeout * 1000)))
+    since = tracker.mark()
+    await element.click()
+
+    watch = asyncio.create_task(page.evaluate("window.__errorWatch", await_promise=True, return_by_value=True))
+    loaded = asyncio.create_task(tracker.wait_load(since, timeout))
+    try:
+        pending = {watch, loaded}
+        while loaded in pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0.0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                break
+            # A load destroys the watched document, which fails or empties the watch
+            if watch in done and not watch.exception() and isinstance(watch.result(), str) and tracker.loads <= since:
+                return {"outcome": "validation_error", "url": await _url(page), "error": watch.result()}
+
+        if loaded.done() and loaded.result():
+            await tracker.wait_idle(max(0.0, deadline - time.monotonic()))
+            error = await page.evaluate(_ERROR_TEXT_JS % json.dumps(error_selector), return_by_value=True)
+            if isinstance(error, str):
+                return {"outcome": "validation_error", "url": await _url(page), "error": error}
+            return {"outcome": "navigated", "url": await _url(page)}
+        return {"outcome": "timeout", "url": await _url(page)}
+    finally:
+        for task in (watch, loaded):
+            if not task.done():
+                task.cancel()
+
+async def _url(page):
+    try:
+        return await page.evaluate("window.location.href")
+    except Exception:
+        return None
@@ -0,0 +1,120 @@
+import contextvars
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Directory for Chrome trace-event files (chrome://tracing, Perfetto); unset = no file
+TRACE_DIR = os.getenv("EQUIP_TRACE_DIR", "")
+
+_trace = contextvars.ContextVar("trace", default=None)
+_tags = contextvars.ContextVar("span_tags", default={})
+
+class Trace:
+    """Timing spans of one run, each tagged with the tab index and macro id it ran for."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.tabs = {}
+
+    def tab_index(self, page):
+        """Small stable number per tab (keyed by target id), in order of first use."""
+        target = getattr(page, "target_id", None)
+        if target is None:
+            return None
+        return self.tabs.setdefault(target, len(self.tabs))
+
+    def add(self, name, start, end, tags):
+        self.spans.append((name, start - self.origin, end - start, tags))
+
+def start_trace():
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+@contextmanager
+def span_tags(**tags):
+    """Tag every span opened inside the block, e.g. with the macro being worked on."""
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+@contextmanager
+def span(name, page=None, **tags):
+    """Time the block as span `name` of the current run, if one is being traced."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, start, time.perf_counter(), page, **tags)
+
+def record_span(name, start, end, page=None, **tags):
+    """Add an already measured span (perf_counter bounds) to the current run's trace."""
+    trace = _trace.get()
+    if trace is None:
+        return
+    tags = {**_tags.get(), **tags}
+    if page is not None:
+        tags["tab"] = trace.tab_index(page)
+    trace.add(name, start, end, tags)
+
+def summarize_spans(trace):
+    """Count, total, mean and max duration (ms) per span name."""
+    summary = {}
+    for name, _, duration, _ in trace.spans:
+        entry = summary.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        entry["count"] += 1
+        entry["total_ms"] += duration * 1000
+        entry["max_ms"] = max(entry["max_ms"], duration * 1000)
+    return {
+        name: {
+            "count": entry["count"],
+            "total_ms": round(entry["total_ms"], 1),
+            "mean_ms": round(entry["total_ms"] / entry["count"], 1),
+            "max_ms": round(entry["max_ms"], 1),
+        }
+        for name, entry in sorted(summary.items())
+    }
+
+def write_chrome_trace(trace, label, directory=TRACE_DIR):
+    """
+    Write the spans as Chrome trace events, one thread per tab, and return the file path.
+    Does nothing (returns None) unless a trace directory is configured.
+    """
+    if not directory:
+        return None
+    events = [
+        {
+            "name": name,
+            "cat": name.split(".")[0],
+            "ph": "X",
+            "ts": round(offset * 1e6),
+            "dur": round(duration * 1e6),
+            "pid": 1,
+            "tid": tags.get("tab") or 0,
+            "args": tags,
+        }
+        for name, offset, duration, tags in trace.spans
+    ]
+    events.extend(
+        {"name": "thread_name", "ph": "M", "pid": 1, "tid": index, "args": {"name": f"tab {index}"}}
+        for index in trace.tabs.values()
+    )
+    path = os.path.join(directory, f"equip-{label}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    except OSError as e:
+        print(f"[TRACE] could not write {path}: {e}", file=sys.stderr)
+        return None
+    return path
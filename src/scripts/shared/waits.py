@@ -0,0 +1,51 @@
+import asyncio
+import json
+import time
+
+_WAIT_FOR_SELECTOR_JS = """
+new Promise((resolve) => {
+    const selector = %s;
+    if (document.querySelector(selector)) return resolve(true);
+    const timer = setTimeout(() => { observer.disconnect(); resolve(false); }, %d);
+    const observer = new MutationObserver(() => {
+        if (document.querySelector(selector)) {
+            observer.disconnect();
+            clearTimeout(timer);
+            resolve(true);
+        }
+    });
+    observer.observe(document, { childList: true, subtree: true, attributes: true });
+})
+"""
+
+async def wait_for_element(page, selector, timeout=30, check_interval=0.1):
+    """
+    Wait until `selector` matches, resolving as soon as the DOM changes instead of polling.
+    An in-page MutationObserver promise does the waiting; if the page navigates away
+    mid-wait the observer is re-armed on the new document after `check_interval`.
+    Returns the element, or None once `timeout` seconds have passed.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            element = await page.query_selector(selector)
+            if element:
+                return element
+        except Exception:
+            pass
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+
+        try:
+            found = await page.evaluate(
+                _WAIT_FOR_SELECTOR_JS % (json.dumps(selector), int(remaining * 1000)),
+                await_promise=True,
+                return_by_value=True,
+            )
+        except Exception:
+            found = None
+
+        if found is not True and time.monotonic() < deadline:
+            await asyncio.sleep(check_interval)
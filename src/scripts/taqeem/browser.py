@@ -1,25 +1,13 @@
-import asyncio, time
+import asyncio
 import nodriver as uc
 
+from fillerRuntime import forget_filler
+from readiness import forget_readiness
+from waits import wait_for_element
+
 browser = None
 page = None
 
-async def wait_for_element(page, selector, timeout=30, check_interval=1):
-    start_time = time.time()
-
-    while time.time() - start_time < timeout:
-        try:
-            element = await page.query_selector(selector)
-
-            if element:
-                return element
-            
-        except Exception:
-            pass
-
-        await asyncio.sleep(check_interval)
-    return None
-
 async def get_browser():
     global browser
 
@@ -32,6 +20,9 @@ async def closeBrowser():
     global browser, page
 
     if browser:
+        for tab in browser.tabs:
+            forget_readiness(tab)
+            await forget_filler(tab, unregister=False)
         try:
             await browser.stop()
 
@@ -4,6 +4,9 @@ import traceback
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from formSteps import form_steps
+from browser import wait_for_element
+from readiness import navigate, settle, click_outcome
+from fillerRuntime import fill_fields, fill_late, present_selectors, unfilled
 
 import json
 
@@ -21,65 +24,19 @@ async def bulk_inject_inputs(page, record, field_map, field_types):
         value = str(record[key] or "")
 
         # separate dynamic selects from normal
-        if field_type == "select":
-            selects[selector] = {"type": "select", "value": value}
+        if field_type in ["select", "dynamic_select"]:
+            selects[selector] = {"type": field_type, "value": value}
         elif field_type == "text":
             others[selector] = {"type": "text", "value": value}
         elif field_type == "checkbox":
             others[selector] = {"type": "checkbox", "value": bool(value)}
-        elif field_type in ["dynamic_select", "location", "file"]:
+        elif field_type in ["location", "file"]:
           continue
 
-    async def inject(jsdata):
-        if not jsdata:
-            return
-        data_json = json.dumps(jsdata)
-        js = f"""
-        (function() {{
-            const data = {data_json};
-            for (const [selector, meta] of Object.entries(data)) {{
-                const el = document.querySelector(selector);
-                if (!el) continue;
-
-                switch (meta.type) {{
-                    case "checkbox":
-                        el.checked = meta.value;
-                        el.dispatchEvent(new Event("change", {{ bubbles: true }}));
-                        break;
-
-                    case "select":
-                        let matched = false;
-                        for (const option of el.options) {{
-                            if (option.value == meta.value || option.text == meta.value) {{
-                                el.value = option.value;
-                                matched = true;
-                                break;
-                            }}
-                        }}
-                        if (!matched && el.options.length) {{
-                            el.selectedIndex = 0;
-                        }}
-                        el.dispatchEvent(new Event("change", {{ bubbles: true }}));
-                        break;
-
-                    case "text":
-                    default:
-                        el.value = meta.value;
-                        el.dispatchEvent(new Event("input", {{ bubbles: true }}));
-                        el.dispatchEvent(new Event("change", {{ bubbles: true }}));
-                        break;
-                }}
-            }}
-            return true;
-        }})();
-        """
-        await page.evaluate(js)
-
-    # Inject selects first (so dependent dropdowns can update)
-    await inject(selects)
-
-    # Then inject text + checkboxes
-    await inject(others)
+    # Selects first, so dependent dropdowns can update
+    report = await fill_fields(page, {**selects, **others})
+    dynamic = {selector: meta for selector, meta in selects.items() if meta["type"] == "dynamic_select"}
+    return await fill_late(page, dynamic, report)
 
 
 async def select_select2_option_simple(page, selector, value):
@@ -133,26 +90,18 @@ async def select_select2_option_simple(page, selector, value):
         return False
 
 
-async def wait_for_element(page, selector, timeout=30, check_interval=1):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            element = await page.query_selector(selector)
-            if element:
-                return element
-        except Exception:
-            pass
-        await asyncio.sleep(check_interval)
-    return None
-
-
 # ------------------------------
 # Fill form (with bulk injection)
 # ------------------------------
 async def fill_form(page, record, field_map, field_types, is_last_step=False, retries=0, max_retries=2):
     try:
         # bulk inject everything except location/file
-        await bulk_inject_inputs(page, record, field_map, field_types)
+        report = await bulk_inject_inputs(page, record, field_map, field_types)
+        for selector, outcome in unfilled(report).items():
+            print(f"Warning: {selector} not set exactly ({outcome})")
+        files_present = await present_selectors(page, [
+            selector for key, selector in field_map.items() if key in record and field_types.get(key) == "file"
+        ])
 
         # handle location + file separately
         for key, selector in field_map.items():
@@ -164,41 +113,14 @@ async def fill_form(page, record, field_map, field_types, is_last_step=False, re
 
             try:
 
-                if field_type == "dynamic_select":
-                    print("trying to select element")
-                    select_element = await wait_for_element(page, selector, timeout=10)
-                    print(f"selected element: {select_element}")
-                    if not select_element:
-                        print(f"Warning: No select element found for selector {selector}")
-                        continue
-
-                    options = select_element.children
-                    option_found = False
-
-                    for option in options:
-                        option_text = option.text or ""
-                        if option_text.lower() == value.lower():
-                            await option.select_option()
-                            option_found = True
-                            break
-
-                    if not option_found:
-                        for option in options:
-                            option_text = (option.text or "").strip()
-                            if value.lower() in option_text.lower():
-                                await option.select_option()
-                                option_found = True
-                                print(f"Warning: Approx match used for '{value}'")
-                                break
-
-                elif field_type == "location":
+                if field_type == "location":
                     success = await select_select2_option_simple(page, selector, value)
                     if not success:
                         print(f"Failed to select location '{value}'")
 
 
                 elif field_type == "file":
-                    file_input = await wait_for_element(page, selector, timeout=10)
+                    file_input = await page.query_selector(selector) if selector in files_present else None
                     if file_input:
                         print(f"Sending file {value}")
                         try:
@@ -217,12 +139,10 @@ async def fill_form(page, record, field_map, field_types, is_last_step=False, re
             continue_btn = await wait_for_element(page, "input[name='continue']", timeout=10)
             if continue_btn:
                 print("Clicking continue button...")
-                await asyncio.sleep(0.5)
-                await continue_btn.click()
-                await asyncio.sleep(2)
-
-                error_div = await wait_for_element(page, "div[class='alert alert-danger']", timeout=10)
-                if error_div:
+                await settle(page, timeout=2, replaces=0.5)
+                outcome = await click_outcome(page, continue_btn, error_selector="div[class='alert alert-danger']",
+                                              replaces=2)
+                if outcome["outcome"] == "validation_error":
                     print("Validation error found: retrying step")
                     if retries < max_retries:
                         await asyncio.sleep(1)
@@ -238,10 +158,12 @@ async def fill_form(page, record, field_map, field_types, is_last_step=False, re
             print("Last step completed - clicking save button")
             save_btn = await wait_for_element(page, "input[name='save']", timeout=10)
             if save_btn:
-                await asyncio.sleep(0.5)
-                await save_btn.click()
-                await asyncio.sleep(5)
-                current_url = await page.evaluate("window.location.href")
+                await settle(page, timeout=2, replaces=0.5)
+                outcome = await click_outcome(page, save_btn, error_selector="div[class='alert alert-danger']",
+                                              replaces=5)
+                if outcome["outcome"] != "navigated":
+                    return {"status": "FAILED", "error": outcome.get("error") or "No response to save"}
+                current_url = outcome["url"] or ""
                 print(f"Current URL: {current_url}")
                 form_id = current_url.rstrip("/").split("/")[-1]
                 print(f"Extracted formId: {form_id}")
@@ -293,8 +215,7 @@ async def runFormFill(page, batch_id):
                 if is_last_step and not record_failed:
                     results.append({"status": "FORM_FILL_SUCCESS", "message": "Form submitted", "recordId": str(record["_id"]), "batchId": batch_id})
 
-            await page.get("https://qima.taqeem.sa/report/create/1/137")
-            await asyncio.sleep(1)
+            await navigate(page, "https://qima.taqeem.sa/report/create/1/137", replaces=1)
 
         return {"status": "SUCCESS", "batchId": batch_id, "failed_records": failed_count, "results": results}
 
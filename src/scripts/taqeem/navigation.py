@@ -1,10 +1,10 @@
 from browser import wait_for_element
+from readiness import navigate
 import asyncio
 
 async def post_login_navigation(page):
     try:
-        await page.get("https://qima.taqeem.sa/report/create/1/137")
-        await asyncio.sleep(1)
+        await navigate(page, "https://qima.taqeem.sa/report/create/1/137", replaces=1)
 
         translate = await wait_for_element(page, "a[href='https://qima.taqeem.sa/setlocale/en']", timeout=30)
         if not translate:
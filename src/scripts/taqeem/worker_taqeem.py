@@ -1,4 +1,7 @@
-import asyncio, sys, json, traceback
+import asyncio, os, sys, json, traceback
+
+# Modules shared with the equip worker (readiness, filler runtime, element waits) live in src/scripts/shared
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shared"))
 
 from login import startLogin, submitOtp
 from formFiller import runFormFill
@@ -5,22 +5,11 @@ import time
 import nodriver as uc
 import traceback
 
+from shared.waits import wait_for_element
+
 browser = None
 page = None
 
-async def wait_for_element(page, selector, timeout=30, check_interval=1):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            element = await page.query_selector(selector)
-            if element:
-                return element
-        except Exception:
-            pass
-        await asyncio.sleep(check_interval)
-    return None
-
-
 async def get_browser():
     global browser
     if browser is None: